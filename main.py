@@ -1,31 +1,43 @@
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from openpyxl.utils.exceptions import InvalidFileException
 from pydantic import BaseModel
 import configparser
 import os
 import pickle
+import sqlite3
+import atexit
 import zlib
 import qrcode
 import base64
 import re
 import struct
+import hashlib
 import uuid
+import time
+import threading
 import tempfile
 import shutil
 import logging
 import pyzbar.pyzbar as pyzbar
 import cv2
+import numpy as np
 from datetime import datetime
-from collections import OrderedDict
+from collections import OrderedDict, Counter
 from typing import List, Dict, Any, Optional
 from openpyxl import load_workbook, Workbook
+from openpyxl.utils import get_column_letter
 from openpyxl.styles import Font, PatternFill, Border, Alignment
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageOps
 import asyncio
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import io
+import queue
+import functools
+import itertools
+import posixpath
+import xml.etree.ElementTree as ET
 
 app = FastAPI()
 
@@ -42,13 +54,985 @@ app.add_middleware(
 OUTPUT_DIR = "output"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
+# xlsx 包内命名空间
+XLSX_NS = {
+    "main": "http://schemas.openxmlformats.org/spreadsheetml/2006/main",
+    "rel": "http://schemas.openxmlformats.org/package/2006/relationships",
+}
+XLSX_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+DIMENSION_PATTERN = re.compile(rb'<(?:\w+:)?dimension\s+ref="([^"]+)"')
+
+# 内容定义分块（CDC）参数 - 收发两端必须一致
+CDC_MIN_SIZE = 2 * 1024
+CDC_AVG_SIZE = 8 * 1024  # 必须为2的幂
+CDC_MAX_SIZE = 64 * 1024
+# Gear 滚动哈希表（由固定种子生成，保证各端分块边界一致）
+CDC_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+DELTA_MARKER = b"DELTA_MODE:"
+
+
+# 图片解码进程池（首次使用时创建）
+DECODE_WORKERS = os.cpu_count() or 1
+_decode_pool = None
+
+
+def get_decode_pool():
+    """获取图片解码进程池"""
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+    return _decode_pool
+
+
+class PyzbarDecoder:
+    """pyzbar 解码后端"""
+    name = "pyzbar"
+
+    def decode(self, image):
+        """解码图片，返回 [(二维码内容, 角点坐标), ...]"""
+        return [(r.data.decode('utf-8'), [(p.x, p.y) for p in r.polygon])
+                for r in pyzbar.decode(image) if r.type == 'QRCODE']
+
+
+class OpenCVDecoder:
+    """OpenCV 解码后端 - detectAndDecodeMulti 支持一帧多码"""
+    name = "opencv"
+
+    def __init__(self):
+        self.local = threading.local()  # QRCodeDetector 不是线程安全的
+
+    def decode(self, image):
+        """解码图片，返回 [(二维码内容, 角点坐标), ...]"""
+        detector = getattr(self.local, "detector", None)
+        if detector is None:
+            detector = self.local.detector = cv2.QRCodeDetector()
+
+        if isinstance(image, Image.Image):
+            if image.mode not in ("L", "RGB"):
+                image = image.convert("L")
+            image = np.asarray(image)
+
+        results = []
+        ok, texts, points, _ = detector.detectAndDecodeMulti(image)
+        if ok:
+            for text, pts in zip(texts, points):
+                if text:
+                    results.append((text, [(int(x), int(y)) for x, y in pts]))
+
+        # 单个高密度码 detectAndDecodeMulti 常常失败，再用单码检测
+        if not results:
+            text, pts, _ = detector.detectAndDecode(image)
+            if text:
+                results.append((text, [(int(x), int(y)) for x, y in pts.reshape(-1, 2)]))
+        return results
+
+
+class FallbackDecoder:
+    """依次尝试多个后端，首个有结果即返回"""
+
+    def __init__(self, name, backends):
+        self.name = name
+        self.backends = backends
+
+    def decode(self, image):
+        for backend in self.backends:
+            results = backend.decode(image)
+            if results:
+                return results
+        return []
+
+
+class RaceDecoder:
+    """多个后端并发解码，取最先得到的非空结果"""
+
+    def __init__(self, name, backends):
+        self.name = name
+        self.backends = backends
+        self.pool = ThreadPoolExecutor(max_workers=len(backends) * 2)
+
+    def decode(self, image):
+        futures = [self.pool.submit(backend.decode, image) for backend in self.backends]
+        for future in as_completed(futures):
+            try:
+                results = future.result()
+            except Exception as e:
+                logging.warning(f"解码后端异常: {str(e)}")
+                continue
+            if results:
+                return results
+        return []
+
+
+DECODER_NAMES = ("pyzbar", "opencv", "fallback", "race")
+_decoders = {}
+
+
+def get_decoder(name="pyzbar"):
+    """按名称获取解码器（每个进程缓存一份）"""
+    if name not in _decoders:
+        if name == "pyzbar":
+            _decoders[name] = PyzbarDecoder()
+        elif name == "opencv":
+            _decoders[name] = OpenCVDecoder()
+        elif name == "fallback":
+            _decoders[name] = FallbackDecoder(name, [get_decoder("pyzbar"), get_decoder("opencv")])
+        elif name == "race":
+            _decoders[name] = RaceDecoder(name, [get_decoder("pyzbar"), get_decoder("opencv")])
+        else:
+            raise ValueError(f"未知的解码后端: {name}")
+    return _decoders[name]
+
+
+# 图片解码预处理阶梯：依次尝试，首个成功的阶段即停止
+DECODE_LADDER = ["fast", "full", "threshold", "sharpen", "contrast", "upscale"]
+FAST_DECODE_MAX_SIDE = 1600  # 快速阶段缩放后的最长边
+UPSCALE_MAX_SIDE = 1200  # 超过此尺寸的图片不再放大
+
+# 各后端/阶段的成功次数和耗时，用于调整默认阶梯和选择后端
+DECODE_STAGE_STATS = Counter()
+DECODE_IMAGE_STATS = Counter()
+DECODE_TIME_STATS = Counter()
+
+
+def record_decode_stats(decoder, stage, seconds):
+    """记录一次图片解码的结果"""
+    DECODE_STAGE_STATS[f"{decoder}/{stage or 'failed'}"] += 1
+    DECODE_IMAGE_STATS[decoder] += 1
+    DECODE_TIME_STATS[decoder] += seconds
+
+
+def preprocess_fast(gray):
+    """快速阶段：缩小大图；图片本身较小时跳过（与 full 相同）"""
+    if max(gray.size) <= FAST_DECODE_MAX_SIDE:
+        return None
+    small = gray.copy()
+    small.thumbnail((FAST_DECODE_MAX_SIDE, FAST_DECODE_MAX_SIDE), Image.Resampling.BILINEAR)
+    return small
+
+
+def preprocess_threshold(gray):
+    """自适应阈值：处理反光和光照不均（结果为 ndarray，解码后端直接使用）"""
+    block = max(31, (min(gray.size) // 10) | 1)  # 邻域需覆盖数个模块，且必须为奇数
+    return cv2.adaptiveThreshold(np.asarray(gray), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+                                 cv2.THRESH_BINARY, block, 2)
+
+
+def preprocess_upscale(gray):
+    """放大小图：模块过小时提高识别率"""
+    if max(gray.size) > UPSCALE_MAX_SIDE:
+        return None
+    return gray.resize((gray.width * 2, gray.height * 2), Image.Resampling.LANCZOS)
+
+
+PREPROCESS_STAGES = {
+    "fast": preprocess_fast,
+    "full": np.asarray,  # 灰度 ndarray，解码后端不再各自转换
+    "threshold": preprocess_threshold,
+    "sharpen": lambda gray: gray.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3)),
+    "contrast": lambda gray: ImageOps.autocontrast(gray, cutoff=2),
+    "upscale": preprocess_upscale,
+}
+
+
+# JPEG 降分辨率解码（DCT 域缩放，只解码 1/2、1/4 或 1/8 分辨率）
+DRAFT_SCALES = (8, 4, 2)
+DRAFT_QR_COVERAGE = 0.5  # 假设二维码至少占图片短边的比例
+DRAFT_MIN_MODULE_PX = 3  # 可靠识别所需的每模块最少像素
+
+
+@functools.lru_cache(maxsize=32)
+def estimate_qr_modules(chunk_size):
+    """估算指定数据块大小生成的二维码边长（模块数）"""
+    qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_L)
+    qr.add_data("x" * chunk_size)
+    try:
+        return 17 + 4 * qr.best_fit()
+    except Exception:
+        return 177  # 最大版本 40
+
+
+def choose_draft_scale(size, modules):
+    """按估算的模块像素尺寸选择 JPEG 缩小倍数，1 表示不缩小"""
+    module_px = min(size) * DRAFT_QR_COVERAGE / modules
+    for scale in DRAFT_SCALES:
+        if module_px / scale >= DRAFT_MIN_MODULE_PX:
+            return scale
+    return 1
+
+
+def decode_with_ladder(img, ladder=None, decoder="pyzbar"):
+    """按预处理阶梯解码，返回 (二维码内容列表, 成功的阶段)"""
+    backend = get_decoder(decoder)
+    gray = img.convert("L")
+    for stage in ladder or DECODE_LADDER:
+        prepared = PREPROCESS_STAGES[stage](gray)
+        if prepared is None:
+            continue
+        decoded = [text for text, _ in backend.decode(prepared)]
+        if decoded:
+            return decoded, stage
+    return [], None
+
+
+# 多码整页扫描: 区域解码线程池（每个解码进程一个）
+_region_pool = None
+
+
+def get_region_pool():
+    """获取区域解码线程池"""
+    global _region_pool
+    if _region_pool is None:
+        _region_pool = ThreadPoolExecutor(max_workers=4)
+    return _region_pool
+
+
+def find_finder_patterns(binary):
+    """查找二维码定位图案（回字形），返回 [(中心x, 中心y, 边长), ...]
+
+    binary 为深色像素取 255 的二值图
+    """
+    contours, hierarchy = cv2.findContours(binary, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is None:
+        return []
+    hierarchy = hierarchy[0]
+
+    finders = []
+    for i, contour in enumerate(contours):
+        # 定位图案: 深色外框 -> 浅色环 -> 深色内块，共嵌套两层
+        hole = hierarchy[i][2]
+        if hole == -1 or hierarchy[hole][2] == -1:
+            continue
+        core = hierarchy[hole][2]
+
+        x, y, w, h = cv2.boundingRect(contour)
+        if w < 7 or h < 7 or not 0.7 < w / h < 1.4:
+            continue
+        if cv2.contourArea(contour) < 0.7 * w * h:
+            continue
+        # 内块边长约为外框的 3/7
+        _, _, cw, ch = cv2.boundingRect(contours[core])
+        if not 0.25 < (cw + ch) / (w + h) < 0.6:
+            continue
+        finders.append((x + w / 2, y + h / 2, (w + h) / 2))
+
+    return finders
+
+
+def crosses_quiet_zone(binary, p, q, size):
+    """两个定位图案之间是否隔着静区（连续浅色超过一个定位图案边长）"""
+    dist = ((q[0] - p[0]) ** 2 + (q[1] - p[1]) ** 2) ** 0.5
+    steps = int(dist)
+    if steps <= 0:
+        return False
+    xs = np.linspace(p[0], q[0], steps).astype(int)
+    ys = np.linspace(p[1], q[1], steps).astype(int)
+    light = binary[ys, xs] == 0
+
+    run = longest = 0
+    for value in light:
+        run = run + 1 if value else 0
+        longest = max(longest, run)
+    return longest > size
+
+
+def group_finder_patterns(finders, binary):
+    """将定位图案按直角等腰三角形三个一组，返回 [(拐角, 相邻1, 相邻2), ...]"""
+    candidates = []
+    for a, (ax, ay, asize) in enumerate(finders):
+        near = []
+        for b, (bx, by, bsize) in enumerate(finders):
+            if b == a or not 0.67 < bsize / asize < 1.5:
+                continue
+            # 同一码内定位图案中心相距至少 14 个模块（2倍定位图案边长）
+            dist = ((bx - ax) ** 2 + (by - ay) ** 2) ** 0.5
+            if 1.8 * asize < dist < 30 * asize \
+                    and not crosses_quiet_zone(binary, (ax, ay), (bx, by), asize):
+                near.append((b, bx - ax, by - ay, dist))
+
+        for i, (b, ux, uy, ud) in enumerate(near):
+            for c, vx, vy, vd in near[i + 1:]:
+                ratio = ud / vd
+                cos = (ux * vx + uy * vy) / (ud * vd)
+                if 0.8 < ratio < 1.25 and abs(cos) < 0.2:
+                    candidates.append((abs(cos) + abs(ratio - 1), a, b, c))
+
+    groups = []
+    used = set()
+    for _, a, b, c in sorted(candidates):
+        if used.isdisjoint((a, b, c)):
+            used.update((a, b, c))
+            groups.append((a, b, c))
+    return groups
+
+
+def locate_qr_regions(gray):
+    """定位图片中各二维码所在区域，返回 [(x, y, w, h), ...]"""
+    height, width = gray.shape[:2]
+    boxes = []
+
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    finders = find_finder_patterns(binary)
+    for a, b, c in group_finder_patterns(finders, binary):
+        (ax, ay, size), (bx, by, _), (cx, cy, _) = finders[a], finders[b], finders[c]
+        xs = [ax, bx, cx, bx + cx - ax]  # 第四个角
+        ys = [ay, by, cy, by + cy - ay]
+        # 定位图案中心距边缘半个定位图案，再留出静区
+        margin = size
+        boxes.append((min(xs) - margin, min(ys) - margin, max(xs) + margin, max(ys) + margin))
+
+    # 未找到定位图案组合时使用 OpenCV 的多码定位
+    if not boxes:
+        ok, points = cv2.QRCodeDetector().detectMulti(gray)
+        if ok:
+            for quad in points:
+                x0, y0 = quad.min(axis=0)
+                x1, y1 = quad.max(axis=0)
+                margin = 0.1 * max(x1 - x0, y1 - y0)
+                boxes.append((x0 - margin, y0 - margin, x1 + margin, y1 + margin))
+
+    regions = []
+    for x0, y0, x1, y1 in boxes:
+        x0, y0 = max(0, int(x0)), max(0, int(y0))
+        x1, y1 = min(width, int(x1)), min(height, int(y1))
+        if x1 - x0 > 0 and y1 - y0 > 0:
+            regions.append((x0, y0, x1 - x0, y1 - y0))
+    return regions
+
+
+def scan_grid(img, ladder=None, decoder="pyzbar"):
+    """整页多码扫描：按定位图案切分区域并行解码，只对失败区域使用完整预处理阶梯
+
+    返回 (二维码内容列表, 成功的阶段, 各区域结果)
+    """
+    gray = img.convert("L")
+    regions = locate_qr_regions(np.asarray(gray))
+    if not regions:
+        decoded, stage = decode_with_ladder(gray, ladder, decoder)
+        return decoded, stage, []
+
+    backend = get_decoder(decoder)
+    crops = [gray.crop((x, y, x + w, y + h)) for x, y, w, h in regions]
+    pool = get_region_pool()
+
+    # 第一轮: 各区域直接解码
+    results = list(pool.map(lambda crop: [text for text, _ in backend.decode(crop)], crops))
+    stages = ["full" if decoded else None for decoded in results]
+
+    # 第二轮: 只对失败的区域逐级预处理
+    retry_ladder = [stage for stage in ladder or DECODE_LADDER if stage not in ("fast", "full")]
+    missed = [i for i, decoded in enumerate(results) if not decoded]
+    if missed and retry_ladder:
+        retried = pool.map(lambda i: decode_with_ladder(crops[i], retry_ladder, decoder), missed)
+        for i, (decoded, stage) in zip(missed, retried):
+            results[i], stages[i] = decoded, stage
+
+    reports = [{"box": list(region), "ok": bool(decoded), "stage": stage}
+               for region, decoded, stage in zip(regions, results, stages)]
+    decoded = list(OrderedDict.fromkeys(text for texts in results for text in texts))
+    if all(results):
+        return decoded, "grid", reports
+
+    # 有区域仍未识别时再做一次整图解码并合并结果（切分可能截断了二维码），整页模式不少于普通扫描
+    full, stage = decode_with_ladder(img, ladder, decoder)
+    if not decoded:
+        return full, stage, reports
+    return list(OrderedDict.fromkeys(decoded + full)), "grid", reports
+
+
+def decode_image_source(source, ladder=None, decoder="pyzbar", modules=None, grid=False):
+    """解码单张图片中的二维码 - 在解码进程中执行
+
+    source 可以是 data URL、图片字节或服务器解析出的文件路径（不接受客户端给出的路径），返回 (二维码内容列表, 成功的阶段, 耗时秒数, 各区域结果)。
+    给出 modules（估算的二维码边长模块数）时，JPEG 先按缩小的分辨率解码；
+    grid 为 True 时按整页多码方式逐区域解码（不做缩小解码）
+    """
+    started = time.perf_counter()
+    if isinstance(source, str) and source.startswith("data:"):
+        source = base64.b64decode(source.split(",")[1])
+
+    def open_image():
+        return Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+
+    img = open_image()
+    if grid:
+        decoded, stage, regions = scan_grid(img, ladder, decoder)
+        return decoded, stage, time.perf_counter() - started, regions
+
+    if modules and img.format == "JPEG":
+        scale = choose_draft_scale(img.size, modules)
+        if scale > 1:
+            img.draft("L", (img.width // scale, img.height // scale))
+            decoded, _ = decode_with_ladder(img, ["full"], decoder)
+            if decoded:
+                return decoded, f"draft1/{scale}", time.perf_counter() - started, None
+            # 缩小后未识别，按原分辨率重新解码
+            img = open_image()
+
+    decoded, stage = decode_with_ladder(img, ladder, decoder)
+    return decoded, stage, time.perf_counter() - started, None
+
+
+class ChunkAssembler:
+    """分块收集器 - 跨多轮扫描累计分块，按传输分组，记录缺少的分块
+
+    一段视频或一批图片可以包含多个文件的二维码序列: 分块头带传输标识（"v8#标识"）时按标识分组，
+    否则按 分块总数-模式-版本 推断；没有分块头的单个二维码各自是一个传输
+    """
+
+    def __init__(self):
+        self.transfers = OrderedDict()  # 传输标识 -> {分块编号: 二维码内容}
+        self.totals = {}  # 传输标识 -> 分块总数
+        self.last_added = {}  # 传输标识 -> 最近新增的分块编号
+        self.singles = []  # 单个二维码（无分块头）
+        self.wrapped = False  # 已齐全的传输又出现了其他分块（视频循环回到开头）
+
+    @staticmethod
+    def parse_header(qr_data):
+        """解析分块头，返回 (分块编号, 总数)；不是有效分块时返回 None"""
+        # 分块格式: "QR:2/5|v8#传输标识|mode|base64数据"（旧格式没有传输标识）
+        parts = qr_data.split('|', 3)
+        if len(parts) < 4:
+            return None
+        try:
+            chunk_num, total = (int(x) for x in parts[0][3:].split('/'))
+        except ValueError:
+            return None
+        if not 1 <= chunk_num <= total:
+            return None
+        return chunk_num, total
+
+    @staticmethod
+    def transfer_key(qr_data):
+        """分块所属传输的标识: 分块头中的传输标识，没有时由 分块总数-模式-版本 推断"""
+        header, version, mode, _ = qr_data.split('|', 3)
+        version, _, transfer_id = version.partition('#')
+        return transfer_id or f"{header.split('/')[1]}-{mode}-{version}"
+
+    def add(self, qr_data):
+        """加入一个二维码内容，返回是否为新数据"""
+        if qr_data.startswith("QR:"):
+            header = self.parse_header(qr_data)
+            if header is None:
+                return False
+            chunk_num, total = header
+            key = self.transfer_key(qr_data)
+            chunks = self.transfers.setdefault(key, {})
+            if chunk_num in chunks:
+                if len(chunks) == self.totals[key] and chunk_num != self.last_added[key]:
+                    self.wrapped = True
+                return False
+            chunks[chunk_num] = qr_data
+            self.totals[key] = total
+            self.last_added[key] = chunk_num
+            return True
+
+        if qr_data in self.singles:
+            return False
+        self.singles.append(qr_data)
+        return True
+
+    @property
+    def empty(self):
+        return not self.transfers and not self.singles
+
+    @property
+    def received(self):
+        return sum(len(chunks) for chunks in self.transfers.values()) + len(self.singles)
+
+    @property
+    def total(self):
+        return sum(self.totals.values()) + len(self.singles)
+
+    @property
+    def complete(self):
+        """已出现的传输都已齐全"""
+        return not self.empty and all(len(chunks) == self.totals[key] for key, chunks in self.transfers.items())
+
+    @property
+    def settled(self):
+        """分块传输都已齐全，且视频已循环回到齐全传输的其他分块
+
+        只是推测视频已循环: 某个文件的序列播放两遍后才出现的其他文件会被漏掉，知道文件个数时用 finished(expect_transfers)
+        """
+        return bool(self.transfers) and self.complete and self.wrapped
+
+    def finished(self, expect_transfers=None):
+        """可以结束扫描: 给出 expect_transfers 时已有这么多个传输且都齐全，否则按 settled 推测"""
+        if expect_transfers:
+            return self.complete and len(self.transfers) + len(self.singles) >= expect_transfers
+        return self.settled
+
+    def missing_chunks(self, key):
+        """某个传输缺少的分块编号"""
+        chunks = self.transfers[key]
+        return [i for i in range(1, self.totals[key] + 1) if i not in chunks]
+
+    def missing(self):
+        """缺少的分块编号；有多个分块传输时按传输标识分组，只列出不完整的传输"""
+        if len(self.transfers) <= 1:
+            return [i for key in self.transfers for i in self.missing_chunks(key)]
+        return {key: self.missing_chunks(key) for key in self.transfers if len(self.transfers[key]) < self.totals[key]}
+
+    def groups(self):
+        """按传输返回 [(传输标识, 分块总数, 按编号排序的二维码内容, 缺少的分块编号), ...]"""
+        groups = [(key, self.totals[key], [chunks[i] for i in sorted(chunks)], self.missing_chunks(key))
+                  for key, chunks in self.transfers.items()]
+        groups += [(f"single-{i + 1}", 1, [qr_data], []) for i, qr_data in enumerate(self.singles)]
+        return groups
+
+    def values(self):
+        """返回已收集的全部二维码内容（各传输按编号排序）"""
+        return [qr_data for _, _, values, _ in self.groups() for qr_data in values]
+
+
+# 视频流水线扫描: 解码线程数和帧队列长度（pyzbar/OpenCV 解码时释放GIL，线程可并行）
+VIDEO_DECODE_WORKERS = max(1, (os.cpu_count() or 1) - 1)
+VIDEO_QUEUE_SIZE = 32
+# 进度回调的最小间隔（秒）
+VIDEO_PROGRESS_INTERVAL = 0.2
+# 帧变化检测: 缩略图边长、缩略图像素灰度差超过多少算变化、变化像素达到多少判定为画面变化、漏检后逐帧解码的帧数
+# （按变化像素数而不是平均差判断，二维码只占画面一小部分时也能发现变化）
+FRAME_THUMB_SIZE = 32
+FRAME_PIXEL_THRESHOLD = 16
+FRAME_DIFF_THRESHOLD = 4
+FRAME_DENSE_SPAN = 8
+# ROI 跟踪: 搜索区域在二维码外框基础上各边扩展的比例（至少 VIDEO_ROI_MIN_MARGIN 像素），连续多少帧后做一次整帧搜索
+VIDEO_ROI_MARGIN = 0.5
+VIDEO_ROI_MIN_MARGIN = 32
+VIDEO_ROI_FULL_INTERVAL = 10
+
+
+class FrameChangeDetector:
+    """帧变化检测 - 比较缩小后的灰度图，跳过与上一次解码帧几乎相同的帧
+
+    幻灯片式视频中每个二维码持续很多帧，只需在画面变化时解码一次；
+    变化后的帧未识别到二维码（切换中的模糊帧等）时，之后一段帧逐帧解码。
+    should_decode 在采集线程中调用，report 在各解码线程中调用
+    """
+
+    def __init__(self, threshold=FRAME_DIFF_THRESHOLD, dense_span=FRAME_DENSE_SPAN):
+        self.threshold = threshold
+        self.dense_span = dense_span
+        self.reference = None  # 上一次解码帧的缩略图
+        self.last_index = 0  # 最近检查的帧序号
+        self.dense_until = 0  # 此帧序号之前逐帧解码
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def thumbnail(frame):
+        """缩小为灰度缩略图，用于比较画面变化"""
+        small = cv2.resize(frame, (FRAME_THUMB_SIZE, FRAME_THUMB_SIZE), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def should_decode(self, index, frame):
+        """第 index 帧是否需要解码"""
+        thumb = self.thumbnail(frame)
+        with self.lock:
+            self.last_index = index
+            if (self.reference is not None and index > self.dense_until
+                    and (cv2.absdiff(thumb, self.reference) > FRAME_PIXEL_THRESHOLD).sum() < self.threshold):
+                self.skipped += 1
+                return False
+            self.reference = thumb
+            return True
+
+    def report(self, index, found):
+        """报告第 index 帧的解码结果；画面变化后的帧漏检时，从当前位置起逐帧解码一段"""
+        with self.lock:
+            if not found and index > self.dense_until:
+                self.dense_until = max(index, self.last_index) + self.dense_span
+
+
+class RoiTracker:
+    """ROI 跟踪 - 记住上一次解码结果中二维码的位置，后续帧只在其附近搜索
+
+    每隔 full_interval 帧，或上一次未识别到二维码时，退回整帧搜索。各解码线程共用，解码本身不持有锁
+    """
+
+    def __init__(self, margin=VIDEO_ROI_MARGIN, full_interval=VIDEO_ROI_FULL_INTERVAL):
+        self.margin = margin
+        self.full_interval = full_interval
+        self.box = None  # 上一次二维码外框 (x0, y0, x1, y1)
+        self.since_full = 0  # 距上一次整帧搜索的帧数
+        self.roi_decodes = 0
+        self.full_decodes = 0
+        self.lock = threading.Lock()
+
+    def region(self, shape):
+        """下一帧的搜索区域 (x0, y0, x1, y1)；返回 None 时整帧搜索"""
+        with self.lock:
+            box = self.box
+            if box is None or self.since_full >= self.full_interval:
+                return None
+        height, width = shape[:2]
+        x0, y0, x1, y1 = box
+        mx = max(int((x1 - x0) * self.margin), VIDEO_ROI_MIN_MARGIN)
+        my = max(int((y1 - y0) * self.margin), VIDEO_ROI_MIN_MARGIN)
+        return max(x0 - mx, 0), max(y0 - my, 0), min(x1 + mx, width), min(y1 + my, height)
+
+    def update(self, results, full):
+        """记录一帧的解码结果；full 表示本帧做了整帧搜索"""
+        points = [point for _, polygon in results for point in polygon]
+        with self.lock:
+            if full:
+                self.since_full = 0
+                self.full_decodes += 1
+            else:
+                self.since_full += 1
+                self.roi_decodes += 1
+
+            if points:
+                xs = [x for x, _ in points]
+                ys = [y for _, y in points]
+                self.box = (min(xs), min(ys), max(xs), max(ys))
+            elif full:
+                self.box = None
+
+
+class VideoScanner:
+    """流水线视频扫描 - 采集线程读取帧放入有界队列，多个解码线程并行解码，分块在收集器中集中去重"""
+
+    def __init__(self, decoder="pyzbar", workers=VIDEO_DECODE_WORKERS, assembler=None, progress_callback=None,
+                 skip_similar=True, stop_when_complete=True, track_roi=True, chunk_callback=None, settle_frames=None,
+                 expect_transfers=None):
+        self.decoder = get_decoder(decoder)
+        self.workers = max(1, workers)
+        self.assembler = assembler if assembler is not None else ChunkAssembler()
+        self.progress_callback = progress_callback  # progress_callback(scanner)
+        self.chunk_callback = chunk_callback  # chunk_callback(二维码内容)，每个新分块调用一次
+        # 跳过与上一次解码帧几乎相同的帧
+        self.detector = FrameChangeDetector() if skip_similar else None
+        # 只在上一次二维码位置附近解码
+        self.tracker = RoiTracker() if track_roi else None
+        # 按分块头中的总数判断分块齐全后提前结束: 视频文件常循环播放多遍，等循环回到开头后结束；
+        # 给出 settle_frames 时（实时视频源不会循环）齐全后再读取这么多帧仍无新传输即结束；
+        # 给出 expect_transfers 时不做推测，这么多个传输都齐全即结束
+        self.stop_when_complete = stop_when_complete
+        self.settle_frames = settle_frames
+        self.expect_transfers = expect_transfers
+        self.complete_at = None  # 分块齐全时已读取的帧数
+        self.stopped_early = False
+        self.started_at = None
+        self.saved_seconds = None
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        # 复用帧缓冲区（解码完的帧交还给采集线程）和各解码线程的灰度缓冲区，避免逐帧分配
+        self.free_frames = queue.SimpleQueue()
+        self.local = threading.local()
+        self.frame_count = 0
+        self.frames_read = 0
+        self.frames_decoded = 0
+        self.new_chunks = 0
+        self.error = None
+
+    def stop(self):
+        """停止采集，队列中剩余的帧不再解码"""
+        self.stop_event.set()
+
+    def put(self, frames, item):
+        """放入队列；队列满时等待，停止时放弃"""
+        while not self.stop_event.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def capture(self, cap, frames, wait=None, limit=None):
+        """采集线程: 按顺序读取帧放入队列，wait(已读帧数) 用于等待数据到达，最多读取 limit 帧"""
+        try:
+            while not self.stop_event.is_set():
+                if limit and self.frames_read >= limit:
+                    break
+                if wait:
+                    wait(self.frames_read)
+                try:
+                    buffer = self.free_frames.get_nowait()
+                except queue.Empty:
+                    buffer = None
+                ret, frame = cap.read(buffer)
+                if not ret:
+                    break
+                self.frames_read += 1
+                if self.complete_at is not None:
+                    # 齐全后的帧多被变化检测跳过、不经过解码线程，在采集线程中检查
+                    with self.lock:
+                        self.check_complete()
+                if self.detector and not self.detector.should_decode(self.frames_read, frame):
+                    self.free_frames.put(frame)
+                    continue
+                if not self.put(frames, (self.frames_read, frame)):
+                    break
+        except Exception as e:
+            self.error = e
+            self.stop()
+        finally:
+            # 通知解码线程结束（停止时解码线程会清空队列，不会阻塞）
+            for _ in range(self.workers):
+                frames.put(None)
+
+    def to_gray(self, frame):
+        """转换为灰度图，写入本线程复用的缓冲区"""
+        if frame.ndim == 2:
+            return frame
+        gray = getattr(self.local, "gray", None)
+        if gray is None or gray.shape != frame.shape[:2]:
+            gray = self.local.gray = np.empty(frame.shape[:2], dtype=np.uint8)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray)
+
+    def decode_region(self, gray, box=None):
+        """解码灰度帧或其中的区域 box（ndarray 视图，不复制），角点坐标换算回整帧"""
+        if box is None:
+            return self.decoder.decode(gray)
+
+        x0, y0, x1, y1 = box
+        return [(text, [(x + x0, y + y0) for x, y in polygon])
+                for text, polygon in self.decoder.decode(gray[y0:y1, x0:x1])]
+
+    def decode_frame(self, index, frame):
+        """解码一帧，返回 [(二维码内容, 角点坐标), ...]；有 ROI 时先解码 ROI，未识别再整帧搜索"""
+        gray = self.to_gray(frame)
+        if not self.tracker:
+            return self.decode_region(gray)
+
+        box = self.tracker.region(gray.shape)
+        if box is not None:
+            results = self.decode_region(gray, box)
+            if results:
+                self.tracker.update(results, full=False)
+                return results
+
+        results = self.decode_region(gray)
+        self.tracker.update(results, full=True)
+        return results
+
+    def decode_worker(self, frames):
+        """解码线程: 从队列取帧解码，结果交给收集器去重"""
+        while True:
+            item = frames.get()
+            if item is None:
+                break
+            if self.stop_event.is_set():
+                continue
+
+            index, frame = item
+            try:
+                results = self.decode_frame(index, frame)
+            except Exception as e:
+                logging.warning(f"第 {index} 帧解码失败: {str(e)}")
+                results = []
+            self.free_frames.put(frame)
+            if self.detector:
+                self.detector.report(index, bool(results))
+
+            with self.lock:
+                self.frames_decoded += 1
+                for qr_data, _ in results:
+                    if self.assembler.add(qr_data):
+                        self.new_chunks += 1
+                        if self.chunk_callback:
+                            self.chunk_callback(qr_data)
+                self.check_complete()
+
+    def check_complete(self):
+        """分块齐全时提前结束（调用方持有 self.lock）"""
+        if not self.stop_when_complete or self.stopped_early:
+            return
+        if not self.assembler.complete:
+            self.complete_at = None
+            return
+        if self.expect_transfers or self.settle_frames is None:
+            if self.assembler.finished(self.expect_transfers):
+                self.finish_early()
+            return
+        if self.complete_at is None:
+            self.complete_at = self.frames_read
+        if self.frames_read - self.complete_at >= self.settle_frames:
+            self.finish_early()
+
+    def finish_early(self):
+        """分块已齐全: 停止采集，按当前读帧速度估算节省的时间"""
+        self.stopped_early = True
+        self.stop()
+        remaining = self.frame_count - self.frames_read
+        if remaining > 0 and self.frames_read:
+            elapsed = time.time() - self.started_at
+            self.saved_seconds = round(elapsed / self.frames_read * remaining, 1)
+        logging.info(f"分块已齐全，在第 {self.frames_read}/{self.frame_count} 帧提前结束扫描")
+
+    def run(self, cap, wait=None, limit=None):
+        """扫描已打开的视频（从当前位置起最多 limit 帧），返回本次新增的分块数"""
+        self.frame_count = limit or int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.started_at = time.time()
+        frames = queue.Queue(maxsize=VIDEO_QUEUE_SIZE)
+
+        threads = [threading.Thread(target=self.capture, args=(cap, frames, wait, limit), daemon=True)]
+        threads += [threading.Thread(target=self.decode_worker, args=(frames,), daemon=True)
+                    for _ in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        # 合并进度通知，不按帧写入
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(VIDEO_PROGRESS_INTERVAL)
+                if self.progress_callback:
+                    self.progress_callback(self)
+
+        if self.error:
+            raise self.error
+        return self.new_chunks
+
+    @property
+    def frames_skipped(self):
+        return self.detector.skipped if self.detector else 0
+
+    def stats(self):
+        """帧统计: 读取/解码/跳过的帧数、ROI/整帧解码次数，以及提前结束时未读取的帧数和估算节省的秒数"""
+        return {
+            "frames_read": self.frames_read,
+            "frames_decoded": self.frames_decoded,
+            "frames_skipped": self.frames_skipped,
+            "roi_decodes": self.tracker.roi_decodes if self.tracker else 0,
+            "full_decodes": self.tracker.full_decodes if self.tracker else self.frames_decoded,
+            "stopped_early": self.stopped_early,
+            "frames_remaining": max(self.frame_count - self.frames_read, 0) if self.stopped_early else 0,
+            "saved_seconds": self.saved_seconds
+        }
+
+
+# 实时视频源: 读取失败后重试间隔，默认多少秒没有新帧时结束
+STREAM_RETRY_INTERVAL = 0.5
+STREAM_IDLE_TIMEOUT = 30
+STREAM_MAX_IDLE_TIMEOUT = 3600
+# 实时视频源不会循环回到开头: 分块齐全后再读取多少帧仍没有新传输时结束
+STREAM_SETTLE_FRAMES = 30
+# 实时扫描最长持续时间（秒）: 默认值和允许的上限
+STREAM_MAX_DURATION = 3600
+STREAM_DURATION_LIMIT = 24 * 3600
+# 实时扫描可能持续很久，使用单独的线程池，不占用序列化、生成二维码等后台任务线程；同时进行的数量有上限
+STREAM_WORKERS = int(os.environ.get("STREAM_WORKERS", 4))
+stream_slots = threading.BoundedSemaphore(STREAM_WORKERS)
+_stream_pool = None
+
+
+def get_stream_pool():
+    """获取实时扫描线程池"""
+    global _stream_pool
+    if _stream_pool is None:
+        _stream_pool = ThreadPoolExecutor(max_workers=STREAM_WORKERS, thread_name_prefix="stream")
+    return _stream_pool
+
+
+class StreamCapture:
+    """实时视频源 - 包装 cv2.VideoCapture（设备编号、RTSP 地址、管道或正在追加写入的文件）
+
+    读取失败时重新打开视频源（文件从已读位置继续，网络流重连），超过 idle_timeout 秒仍无新帧、
+    已持续 max_duration 秒或 stop_event 置位时结束
+    """
+
+    def __init__(self, source, idle_timeout=STREAM_IDLE_TIMEOUT, stop_event=None, max_duration=STREAM_MAX_DURATION):
+        self.source = int(source) if source.isdigit() else source
+        self.idle_timeout = idle_timeout
+        self.stop_event = stop_event or threading.Event()
+        self.ends_at = time.time() + max_duration
+        self.timed_out = False  # 因达到最长持续时间而结束
+        self.frames = 0
+        self.cap = self.open()
+
+    def open(self):
+        cap = cv2.VideoCapture(self.source)
+        if not cap.isOpened():
+            raise ValueError(f"无法打开视频源: {self.source}")
+        return cap
+
+    def get(self, prop):
+        # 实时视频源没有总帧数
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return 0
+        return self.cap.get(prop)
+
+    def read(self, image=None):
+        if time.time() >= self.ends_at:
+            self.timed_out = True
+            return False, None
+        deadline = min(time.time() + self.idle_timeout, self.ends_at)
+        while True:
+            ret, frame = self.cap.read(image)
+            if ret:
+                self.frames += 1
+                return ret, frame
+            if self.stop_event.wait(STREAM_RETRY_INTERVAL) or time.time() >= deadline:
+                return False, None
+
+            # 重新打开视频源等待新数据
+            self.cap.release()
+            try:
+                self.cap = self.open()
+            except ValueError:
+                continue
+            if isinstance(self.source, str) and os.path.isfile(self.source):
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames)
+
+    def release(self):
+        self.cap.release()
+
+
+# 长视频分段并行扫描: 自动分段时每段至少多少帧，相邻段重叠的帧数（定位不精确时避免漏掉段边界的分块）
+VIDEO_SEGMENT_MIN_FRAMES = 1800
+VIDEO_SEGMENT_OVERLAP = 30
+VIDEO_MAX_SEGMENTS = 64
+# 分段结果中累加的帧统计
+VIDEO_SEGMENT_COUNTERS = ("frames_read", "frames_decoded", "frames_skipped", "roi_decodes", "full_decodes")
+
+
+def video_segments(frame_count, count):
+    """把视频的 frame_count 帧切成 count 段，返回 [(起始帧, 结束帧), ...]，相邻段略有重叠"""
+    size = -(-frame_count // count)
+    overlap = min(VIDEO_SEGMENT_OVERLAP, size // 4)
+    return [(max(i * size - overlap, 0), min((i + 1) * size, frame_count))
+            for i in range(count) if i * size < frame_count]
+
+
+def scan_video_segment(video_path, start, end, decoder_name, stop_path=None, stop_when_complete=True,
+                       expect_transfers=None):
+    """扫描视频的 [start, end) 帧 - 在解码进程中执行，返回 (二维码内容列表, 帧统计)
+
+    stop_path 文件出现时停止扫描（其他分段已收集齐分块），返回已读取部分的结果；
+    stop_when_complete、expect_transfers 同 VideoScanner
+    """
+    def check_stop(scanner):
+        if os.path.exists(stop_path):
+            scanner.stop()
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("无法打开视频文件")
+    try:
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+        # 各段已在独立进程中并行，段内只用一个解码线程；进度回调时检查停止标记
+        scanner = VideoScanner(decoder_name, workers=1, progress_callback=check_stop if stop_path else None,
+                               stop_when_complete=stop_when_complete, expect_transfers=expect_transfers)
+        scanner.run(cap, limit=end - start)
+    finally:
+        cap.release()
+    return scanner.assembler.values(), scanner.stats()
+
+
 class QRProcessor:
-    def __init__(self, output_dir):
+    def __init__(self, output_dir, save_copies=True):
         self.output_dir = output_dir
+        self.save_copies = save_copies  # 序列化后是否在输出目录保存 .qrdat 副本
         os.makedirs(output_dir, exist_ok=True)
 
-    def serialize_excel_region(self, excel_path, region, sheet_name=None, version=8, progress_callback=None):
-        """序列化Excel区域"""
+    def serialize_excel_region(self, excel_path, region, sheet_name=None, version=8, progress_callback=None,
+                               source_name=None):
+        """序列化Excel区域（excel_path 也可以是文件对象，此时需给出 source_name）"""
         if progress_callback:
             progress_callback(0, "加载Excel文件...")
 
@@ -69,7 +1053,7 @@ class QRProcessor:
             'styles': [],
             'merged': [m.coord for m in ws.merged_cells.ranges],
             'meta': {
-                'source': os.path.basename(excel_path),
+                'source': source_name or os.path.basename(excel_path),
                 'sheet': sheet_name or ws.title,
                 'region': region,
                 'version': version,
@@ -120,6 +1104,152 @@ class QRProcessor:
 
         return compressed_with_checksum
 
+    def read_sheet_index(self, excel_source):
+        """读取工作簿索引 - 只解析 xl/workbook.xml 和各sheet头部，不加载单元格"""
+        with zipfile.ZipFile(excel_source) as zf:
+            names = set(zf.namelist())
+
+            # 定位 workbook.xml（通常为 xl/workbook.xml）
+            workbook_part = "xl/workbook.xml"
+            if workbook_part not in names and "_rels/.rels" in names:
+                root_rels = ET.fromstring(zf.read("_rels/.rels"))
+                for rel in root_rels.findall("rel:Relationship", XLSX_NS):
+                    if rel.get("Type", "").endswith("/officeDocument"):
+                        workbook_part = rel.get("Target", "").lstrip("/")
+                        break
+
+            workbook = ET.fromstring(zf.read(workbook_part))
+            base_dir = posixpath.dirname(workbook_part)
+
+            # sheet 关系映射: rId -> 包内路径
+            targets = {}
+            rels_part = posixpath.join(base_dir, "_rels", posixpath.basename(workbook_part) + ".rels")
+            if rels_part in names:
+                for rel in ET.fromstring(zf.read(rels_part)).findall("rel:Relationship", XLSX_NS):
+                    target = rel.get("Target", "")
+                    if target.startswith("/"):
+                        target = target.lstrip("/")
+                    else:
+                        target = posixpath.normpath(posixpath.join(base_dir, target))
+                    targets[rel.get("Id")] = target
+
+            sheets = []
+            for idx, sheet in enumerate(workbook.findall("main:sheets/main:sheet", XLSX_NS)):
+                part = targets.get(sheet.get(XLSX_REL_ID))
+                sheets.append({
+                    "name": sheet.get("name"),
+                    "index": idx,
+                    "state": sheet.get("state", "visible"),
+                    "dimension": self.read_sheet_dimension(zf, part) if part in names else None
+                })
+
+            # 活动sheet
+            active_tab = 0
+            view = workbook.find("main:bookViews/main:workbookView", XLSX_NS)
+            if view is not None:
+                try:
+                    active_tab = int(view.get("activeTab", 0))
+                except ValueError:
+                    active_tab = 0
+
+        return {
+            "sheets": sheets,
+            "active": sheets[active_tab]["name"] if 0 <= active_tab < len(sheets) else None
+        }
+
+    def read_sheet_dimension(self, zf, part, max_bytes=64 * 1024):
+        """读取sheet的 <dimension ref> - 只解压文件头部"""
+        head = b""
+        with zf.open(part) as f:
+            while len(head) < max_bytes:
+                block = f.read(4096)
+                if not block:
+                    break
+                head += block
+                match = DIMENSION_PATTERN.search(head)
+                if match:
+                    return match.group(1).decode("utf-8")
+                if b"sheetData" in head:
+                    # dimension 只会出现在 sheetData 之前
+                    break
+        return None
+
+    def detect_used_range(self, excel_source, sheet_name=None, allow_scan=True):
+        """检测sheet已用区域 - 优先使用dimension记录，不可信时流式扫描"""
+        try:
+            index = self.read_sheet_index(excel_source)
+            sheet_name = sheet_name or index["active"]
+            info = next((s for s in index["sheets"] if s["name"] == sheet_name), None)
+            if info is None:
+                raise ValueError(f"Sheet不存在: {sheet_name}")
+            dimension = info["dimension"]
+        except (zipfile.BadZipFile, KeyError, ET.ParseError):
+            dimension = None
+
+        # 部分工具只写 "A1" 或不写 dimension，此时需要扫描
+        if not allow_scan or (dimension and ":" in dimension):
+            return {"sheet": sheet_name, "range": dimension, "source": "dimension"}
+
+        if hasattr(excel_source, "seek"):
+            excel_source.seek(0)
+        wb = load_workbook(excel_source, read_only=True)
+        try:
+            ws = wb[sheet_name] if sheet_name else wb.active
+            ws.reset_dimensions()
+            min_row = min_col = max_row = max_col = None
+            for r, row in enumerate(ws.iter_rows(values_only=True), start=1):
+                cols = [c for c, value in enumerate(row, start=1) if value is not None and value != ""]
+                if not cols:
+                    continue
+                if min_row is None:
+                    min_row = r
+                max_row = r
+                min_col = cols[0] if min_col is None else min(min_col, cols[0])
+                max_col = cols[-1] if max_col is None else max(max_col, cols[-1])
+            used = None
+            if min_row is not None:
+                used = f"{get_column_letter(min_col)}{min_row}:{get_column_letter(max_col)}{max_row}"
+            return {"sheet": sheet_name or ws.title, "range": used, "source": "scan"}
+        finally:
+            wb.close()
+
+    def preview_sheet(self, excel_source, sheet_name=None, region=None, offset=0, limit=20):
+        """分页预览sheet数据 - 只读迭代器，只取值不取样式"""
+        if hasattr(excel_source, "seek"):
+            excel_source.seek(0)
+        wb = load_workbook(excel_source, read_only=True, data_only=True)
+        try:
+            ws = wb[sheet_name] if sheet_name else wb.active
+            if region:
+                min_col, min_row, max_col, max_row = self.parse_region(region)
+            else:
+                min_col, min_row, max_col, max_row = 1, 1, None, None
+
+            start_row = min_row + offset
+            if max_row is not None and start_row > max_row:
+                return {"sheet": ws.title, "start_row": start_row, "rows": [], "has_more": False}
+
+            rows_iter = ws.iter_rows(min_row=start_row, max_row=max_row,
+                                     min_col=min_col, max_col=max_col, values_only=True)
+            rows = [[self.preview_value(v) for v in row] for row in itertools.islice(rows_iter, limit + 1)]
+            return {
+                "sheet": ws.title,
+                "start_row": start_row,
+                "rows": rows[:limit],
+                "has_more": len(rows) > limit
+            }
+        finally:
+            wb.close()
+
+    def preview_value(self, value):
+        """预览单元格值转为可JSON化的类型"""
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return value
+        if hasattr(value, "isoformat"):
+            # datetime / date / time
+            return value.isoformat()
+        return str(value)
+
     def serialize_file(self, file_path, version=8, progress_callback=None):
         """序列化任意文件"""
         try:
@@ -153,20 +1283,127 @@ class QRProcessor:
             final_data = file_marker + compressed_with_checksum
 
             # 保存副本
-            filename = os.path.basename(file_path)
-            with open(os.path.join(self.output_dir, f"{filename}.qrdat"), 'wb') as f:
-                f.write(final_data)
+            if self.save_copies:
+                filename = os.path.basename(file_path)
+                with open(os.path.join(self.output_dir, f"{filename}.qrdat"), 'wb') as f:
+                    f.write(final_data)
 
             return final_data
 
         except Exception as e:
             raise ValueError(f"文件序列化失败: {str(e)}")
 
-    def restore(self, data, output_path=None):
+    def cdc_split(self, data, min_size=CDC_MIN_SIZE, avg_size=CDC_AVG_SIZE, max_size=CDC_MAX_SIZE):
+        """内容定义分块 - Gear滚动哈希，返回各分块的结束位置"""
+        bits = avg_size.bit_length() - 1
+        mask = ((1 << bits) - 1) << (64 - bits)  # 取高位，覆盖最近64字节的窗口
+        gear = CDC_GEAR
+        boundaries = []
+        length = len(data)
+        start = 0
+
+        while start < length:
+            end = min(start + max_size, length)
+            cut = end
+            h = 0
+            # 最小分块长度内不判断切点
+            for i in range(start + min_size, end):
+                h = ((h << 1) + gear[data[i]]) & 0xFFFFFFFFFFFFFFFF
+                if not h & mask:
+                    cut = i + 1
+                    break
+            boundaries.append(cut)
+            start = cut
+
+        return boundaries
+
+    def cdc_chunks(self, data, params=(CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE)):
+        """按内容分块并计算哈希，返回 [(哈希, 分块数据), ...]"""
+        chunks = []
+        start = 0
+        for end in self.cdc_split(data, *params):
+            piece = data[start:end]
+            chunks.append((hashlib.blake2b(piece, digest_size=16).digest(), piece))
+            start = end
+        return chunks
+
+    def serialize_delta(self, file_path, base_path, version=8, progress_callback=None, source_name=None):
+        """增量序列化 - 只打包基准文件中不存在的分块"""
+        try:
+            if progress_callback:
+                progress_callback(0, "读取文件...")
+
+            with open(file_path, 'rb') as f:
+                file_data = f.read()
+            with open(base_path, 'rb') as f:
+                base_data = f.read()
+
+            if progress_callback:
+                progress_callback(20, "内容分块...")
+
+            params = (CDC_MIN_SIZE, CDC_AVG_SIZE, CDC_MAX_SIZE)
+            base_hashes = {digest for digest, _ in self.cdc_chunks(base_data, params)}
+            chunks = self.cdc_chunks(file_data, params)
+
+            # 只保留接收端没有的分块（同一文件内重复的分块也只保留一份）
+            manifest = []
+            new_chunks = {}
+            for digest, piece in chunks:
+                manifest.append(digest)
+                if digest not in base_hashes:
+                    new_chunks[digest] = piece
+
+            reused = len(chunks) - len(new_chunks)
+            if progress_callback:
+                progress_callback(60, f"复用分块 {reused}/{len(chunks)}，新增 {len(new_chunks)}")
+
+            data = {
+                'manifest': manifest,
+                'chunks': new_chunks,
+                'meta': {
+                    'source': source_name or os.path.basename(file_path),
+                    'size': len(file_data),
+                    'sha256': hashlib.sha256(file_data).hexdigest(),
+                    'base_size': len(base_data),
+                    'base_sha256': hashlib.sha256(base_data).hexdigest(),
+                    'cdc': params,
+                    'version': version,
+                    'timestamp': datetime.now().isoformat(),
+                    'mode': 'delta'
+                }
+            }
+
+            compressed = zlib.compress(pickle.dumps(data))
+            if len(compressed) > 10 * 1024 * 1024:  # 10MB
+                raise ValueError("增量数据过大，建议使用区域模式")
+
+            if progress_callback:
+                progress_callback(80, "添加校验和...")
+
+            checksum = zlib.crc32(compressed)
+            final_data = DELTA_MARKER + struct.pack(">I", checksum) + compressed
+
+            # 保存副本
+            if self.save_copies:
+                filename = os.path.basename(file_path)
+                with open(os.path.join(self.output_dir, f"{filename}.qrdat"), 'wb') as f:
+                    f.write(final_data)
+
+            return final_data
+
+        except Exception as e:
+            raise ValueError(f"增量序列化失败: {str(e)}")
+
+    def restore(self, data, output_path=None, base_path=None):
         """从数据恢复文件"""
         try:
+            # 增量模式需要本地基准文件
+            if data.startswith(DELTA_MARKER):
+                if not base_path:
+                    raise ValueError("增量数据需要提供基准文件")
+                return self.restore_delta(data[len(DELTA_MARKER):], base_path, output_path)
             # 检查是否为文件模式
-            if data.startswith(b"FILE_MODE:"):
+            elif data.startswith(b"FILE_MODE:"):
                 return self.restore_file(data[10:], output_path)
             else:
                 return self.restore_excel_region(data, output_path)
@@ -284,8 +1521,58 @@ class QRProcessor:
 
         return output_path
 
-    def create_qr_codes(self, data, max_size=1800, version=8, mode="file", progress_callback=None):
-        """生成二维码序列"""
+    def restore_delta(self, data, base_path, output_path=None):
+        """用基准文件和新分块重建文件"""
+        if len(data) < 4:
+            raise ValueError("数据过短，无法恢复")
+
+        stored_checksum = struct.unpack(">I", data[:4])[0]
+        actual_data = data[4:]
+        actual_checksum = zlib.crc32(actual_data)
+        if stored_checksum != actual_checksum:
+            raise ValueError(f"数据校验失败: {stored_checksum} != {actual_checksum}")
+
+        try:
+            delta = pickle.loads(zlib.decompress(actual_data))
+        except (zlib.error, pickle.UnpicklingError) as e:
+            raise ValueError(f"解析增量数据失败: {str(e)}")
+
+        meta = delta.get('meta', {})
+        if meta.get('mode') != 'delta':
+            raise ValueError("数据模式不匹配")
+
+        with open(base_path, 'rb') as f:
+            base_data = f.read()
+        if hashlib.sha256(base_data).hexdigest() != meta.get('base_sha256'):
+            raise ValueError("基准文件与生成增量时使用的版本不一致")
+
+        # 基准文件按相同参数分块，得到 哈希 -> 数据
+        available = dict(self.cdc_chunks(base_data, tuple(meta['cdc'])))
+        available.update(delta['chunks'])
+
+        parts = []
+        for digest in delta['manifest']:
+            piece = available.get(digest)
+            if piece is None:
+                raise ValueError(f"缺少分块: {digest.hex()}")
+            parts.append(piece)
+        restored = b"".join(parts)
+
+        if hashlib.sha256(restored).hexdigest() != meta.get('sha256'):
+            raise ValueError("重建后的文件校验失败")
+
+        if not output_path:
+            name, ext = os.path.splitext(meta.get('source', 'restored'))
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = os.path.join(self.output_dir, f"{name}_{timestamp}_restored{ext}")
+
+        with open(output_path, 'wb') as f:
+            f.write(restored)
+
+        return output_path
+
+    def plan_qr_chunks(self, data, max_size=1800, version=8, mode="file"):
+        """计算二维码分块内容（不渲染），返回 [(名称, 内容, 标记文本), ...]"""
         # 计算base64编码后的最大原始数据大小
         max_raw_size = int(max_size * 0.7)  # 考虑base64开销
 
@@ -293,41 +1580,88 @@ class QRProcessor:
         if len(data) <= max_raw_size:
             # 使用base64编码
             base64_data = base64.b64encode(data).decode('utf-8')
-            return [("single", self.create_single_qr(base64_data, f"{mode}"))]
+            return [("single", base64_data, f"{mode}")]
 
-        # 计算需要多少分块
+        # 传输标识（由内容决定）: 扫描时据此区分同一段录像/同一批图片中的多个文件
+        transfer_id = hashlib.sha256(data).hexdigest()[:8]
+
+        # 每块原始数据大小: 扣除分块头（按最长的编号计算）后，base64 编码结果不超过 max_size；
+        # 分块数会改变分块头的长度，重新计算直到分块数不再变化
         total_chunks = (len(data) + max_raw_size - 1) // max_raw_size
-        chunks = []
+        while True:
+            header_size = len(f"QR:{total_chunks}/{total_chunks}|v{version}#{transfer_id}|{mode}|")
+            raw_size = min(max_raw_size, (max_size - header_size) // 4 * 3)
+            if raw_size < 1:
+                raise ValueError(f"分块大小过小: {max_size}")
+            count = (len(data) + raw_size - 1) // raw_size
+            if count == total_chunks:
+                break
+            total_chunks = count
 
         # 大数据分块处理
+        plan = []
         for i in range(total_chunks):
-            start = i * max_raw_size
-            end = min(start + max_raw_size, len(data))
-            chunk_data = data[start:end]
+            chunk_data = data[i * raw_size:(i + 1) * raw_size]
 
             # 添加分块头并使用base64编码
-            header = f"QR:{i + 1}/{total_chunks}|v{version}|{mode}|"
+            header = f"QR:{i + 1}/{total_chunks}|v{version}#{transfer_id}|{mode}|"
             base64_chunk = base64.b64encode(chunk_data).decode('utf-8')
+            plan.append((f"chunk_{i + 1}_of_{total_chunks}", header + base64_chunk, f"{i + 1}/{total_chunks}"))
+
+        return plan
 
-            # 检查总长度
-            full_chunk = header + base64_chunk
-            if len(full_chunk) > max_size:
-                # 如果超出，减小分块大小
-                new_max_raw_size = int(max_raw_size * 0.9)
-                return self.create_qr_codes(data, new_max_raw_size, version, mode, progress_callback)
+    def create_qr_codes(self, data, max_size=1800, version=8, mode="file", progress_callback=None, indices=None):
+        """生成二维码序列 - indices 为需要渲染的分块编号（从1开始），None 表示全部"""
+        plan = self.plan_qr_chunks(data, max_size, version, mode)
 
+        if indices is not None:
+            if plan[0][0] == "single":
+                raise ValueError("数据只有单个二维码，无需指定分块")
+            plan = [plan[i - 1] for i in self.parse_chunk_indices(indices, len(plan))]
+
+        chunks = []
+        for i, (name, content, counter) in enumerate(plan):
             # 创建二维码
-            name = f"chunk_{i + 1}_of_{total_chunks}"
-            img = self.create_single_qr(full_chunk, f"{i + 1}/{total_chunks}")
-            chunks.append((name, img))
+            chunks.append((name, self.create_single_qr(content, counter)))
 
             # 更新进度
             if progress_callback:
-                progress = (i + 1) / total_chunks * 100
-                progress_callback(progress, f"生成二维码 {i + 1}/{total_chunks}")
+                progress = (i + 1) / len(plan) * 100
+                progress_callback(progress, f"生成二维码 {i + 1}/{len(plan)}")
 
         return chunks
 
+    def parse_chunk_indices(self, spec, total):
+        """解析分块编号 - 支持整数列表或 "3,17,40-42" 形式的范围"""
+        items = [spec] if isinstance(spec, str) else list(spec)
+
+        indices = set()
+        for item in items:
+            if isinstance(item, int):
+                indices.add(item)
+                continue
+            # 允许直接粘贴 "缺少分块 [3, 17, 42]" 中的列表
+            for part in re.split(r"[,，\s]+", str(item).strip().strip("[]")):
+                if not part:
+                    continue
+                try:
+                    if '-' in part:
+                        first, last = part.split('-', 1)
+                        indices.update(range(int(first), int(last) + 1))
+                    else:
+                        indices.add(int(part))
+                except ValueError:
+                    raise ValueError(f"无效的分块编号: {part}")
+
+        if not indices:
+            raise ValueError("未指定分块编号")
+
+        invalid = sorted(i for i in indices if i < 1 or i > total)
+        if invalid:
+            raise ValueError(f"分块编号超出范围 1-{total}: {invalid}")
+
+        return sorted(indices)
+
     def create_single_qr(self, data, counter=None):
         """创建单个二维码"""
         qr = qrcode.QRCode(
@@ -398,10 +1732,10 @@ class QRProcessor:
                     # 解析模式
                     mode = mode_part
 
-                    # 解析版本
+                    # 解析版本（"v8#传输标识"）
                     if version_part.startswith("v"):
                         try:
-                            version = int(version_part[1:])
+                            version = int(version_part[1:].split('#')[0])
                         except:
                             version = 0
 
@@ -421,14 +1755,26 @@ class QRProcessor:
                 missing = [i for i in range(1, total_chunks + 1) if i not in chunks_dict]
                 raise ValueError(f"数据不完整: 缺少分块 {missing}")
 
-            # 按顺序组合分块
-            combined_b64 = ''.join(chunks_dict[i] for i in sorted(chunks_dict.keys()))
-            return base64.b64decode(combined_b64)
+            # 按顺序组合分块（逐块解码，分块长度不是3的倍数时base64带填充）
+            return b''.join(base64.b64decode(chunks_dict[i]) for i in sorted(chunks_dict.keys()))
 
         except Exception as e:
             # self.log(f"合并数据失败: {str(e)}")
             return None
 
+    def decode_many(self, sources, ladder=None, decoder="pyzbar", modules=None, grid=False):
+        """并行解码多张图片，按完成顺序返回 (序号, 二维码内容列表, 成功的阶段, 各区域结果, 错误信息)"""
+        pool = get_decode_pool()
+        futures = {pool.submit(decode_image_source, source, ladder, decoder, modules, grid): i
+                   for i, source in enumerate(sources)}
+        for future in as_completed(futures):
+            try:
+                decoded, stage, seconds, regions = future.result()
+                record_decode_stats(decoder, stage, seconds)
+                yield futures[future], decoded, stage, regions, None
+            except Exception as e:
+                yield futures[future], [], None, None, str(e)
+
     # 辅助方法
     def parse_region(self, region):
         """解析区域坐标 - 增强容错性"""
@@ -549,8 +1895,13 @@ class QRProcessor:
 
 
 class SerializeRequest(BaseModel):
-    mode: str  # "region" 或 "file"
+    mode: str  # "region"、"file" 或 "delta"
     file_path: Optional[str] = None
+    base_file: Optional[str] = None  # 增量模式: base64 编码的旧版本文件
+    upload_id: Optional[str] = None  # 使用已完成的断点续传上传代替 file_path
+    base_upload_id: Optional[str] = None  # 使用已完成的断点续传上传代替 base_file
+    artifact_id: Optional[str] = None  # 使用制品存储中的文件代替 file_path
+    base_artifact_id: Optional[str] = None  # 使用制品存储中的文件代替 base_file
     region: Optional[str] = None
     sheet_name: Optional[str] = None
     version: int = 8
@@ -560,84 +1911,1098 @@ class SerializeRequest(BaseModel):
 class QRGenerationRequest(BaseModel):
     session_id: str
     max_chunk_size: int = 1800
+    chunks: Optional[List[int]] = None  # 只重新生成指定分块（从1开始）
+    ranges: Optional[str] = None  # 分块范围, 例如 "3,17,40-42"
 
 
 class ScanRequest(BaseModel):
-    # session_id: str
-    files: List[str]  # base64 编码的图片列表
+    session_id: Optional[str] = None  # 续扫: 沿用之前未完成的扫描会话
+    files: List[str] = []  # base64 编码的图片列表
+    artifact_ids: Optional[List[str]] = None  # 制品存储中的图片
+    base_file: Optional[str] = None  # 增量恢复: base64 编码的本地基准文件
+    base_artifact_id: Optional[str] = None  # 使用制品存储中的基准文件代替 base_file
+    ladder: Optional[List[str]] = None  # 预处理阶梯, 默认 DECODE_LADDER
+    decoder: str = "pyzbar"  # 解码后端: pyzbar / opencv / fallback / race
+    draft: bool = True  # JPEG 先按缩小的分辨率解码
+    max_chunk_size: int = 1800  # 生成二维码时的数据块大小，用于估算模块尺寸
+    grid: bool = False  # 整页多码照片: 按区域切分并行解码
 
 
 class VideoScanRequest(BaseModel):
-    session_id: str
-    video: str  # base64 编码的视频文件
+    session_id: Optional[str] = None  # 续扫: 沿用之前未完成的扫描会话
+    video: Optional[str] = None  # base64 编码的视频文件
+    upload_id: Optional[str] = None  # 断点续传上传的视频（可在上传完成前开始扫描）
+    artifact_id: Optional[str] = None  # 制品存储中的视频
+    base_file: Optional[str] = None  # 增量恢复: base64 编码的本地基准文件
+    base_upload_id: Optional[str] = None  # 使用已完成的断点续传上传代替 base_file
+    base_artifact_id: Optional[str] = None  # 使用制品存储中的基准文件代替 base_file
+    decoder: str = "pyzbar"  # 解码后端: pyzbar / opencv / fallback / race
+    segments: Optional[int] = None  # 分段并行扫描的段数，默认按CPU核数和视频长度自动选择
+    # 提前结束: 默认在分块齐全且视频循环后结束；视频中有多个文件时给出文件个数，或关闭提前结束读完整个视频
+    stop_when_complete: bool = True
+    expect_transfers: Optional[int] = None
+
+
+class StreamScanRequest(BaseModel):
+    source: str  # cv2.VideoCapture 可打开的视频源: 设备编号、RTSP 地址、管道或正在写入的文件路径
+    session_id: Optional[str] = None  # 续扫: 沿用之前未完成的扫描会话
+    base_file: Optional[str] = None  # 增量恢复: base64 编码的本地基准文件
+    base_upload_id: Optional[str] = None  # 使用已完成的断点续传上传代替 base_file
+    base_artifact_id: Optional[str] = None  # 使用制品存储中的基准文件代替 base_file
+    decoder: str = "pyzbar"  # 解码后端: pyzbar / opencv / fallback / race
+    idle_timeout: float = STREAM_IDLE_TIMEOUT  # 多少秒没有新帧时结束扫描
+    max_duration: float = STREAM_MAX_DURATION  # 最长扫描多少秒（也可随时调用停止接口）
+
+
+class UploadCreateRequest(BaseModel):
+    size: int  # 文件总字节数
+    file_name: Optional[str] = None  # 原文件名（保留扩展名）
+
+
+class UploadFinalizeRequest(BaseModel):
+    sha256: Optional[str] = None  # 整个文件的 SHA-256，提供时校验
+
+
+# 断点续传上传: upload_id -> ResumableUpload
+uploads = {}
+
+# 幂等任务: 任务键 -> 会话ID（相同输入和参数的请求复用已有会话）
+jobs = {}
+# 保护 jobs；与会话存储的锁同时持有时，先取会话存储的锁
+jobs_lock = threading.Lock()
+
+
+def job_key(kind, *params):
+    """由输入制品ID和参数计算任务键"""
+    return hashlib.sha256(repr((kind,) + params).encode()).hexdigest()
+
+
+# 后台任务线程池: 序列化、生成二维码、扫描等耗时任务不在事件循环中执行，
+# 接口立即返回会话ID，进度和结果写回会话（图片解码另在解码进程池中并行）
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+_job_pool = None
+
+
+def get_job_pool():
+    """获取后台任务线程池"""
+    global _job_pool
+    if _job_pool is None:
+        _job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+    return _job_pool
+
+
+def update_session(session_id, **fields):
+    """写入会话状态（后台任务中调用）；会话已不存在时忽略"""
+    session = sessions.get(session_id)
+    if session is not None:
+        with sessions.session_lock(session_id):
+            session.update(fields)
+
+
+def submit_job(session_id, error_prefix, func, *args, cleanup=None, pool=None):
+    """提交后台任务并立即返回响应内容
+
+    任务结束时由 func 将最终状态和 result 一并写入会话；抛出异常时写入错误状态。
+    pool 默认为后台任务线程池
+    """
+    def run():
+        try:
+            func(*args)
+        except Exception as e:
+            logging.warning(f"后台任务失败 {session_id}: {str(e)}")
+            update_session(session_id, status="error", message=f"{error_prefix}: {str(e)}")
+        finally:
+            if cleanup:
+                cleanup()
+
+    # 清除上一个任务的结果
+    sessions[session_id].pop("result", None)
+    (pool or get_job_pool()).submit(run)
+    return {
+        "session_id": session_id,
+        "status": "processing",
+        "message": "任务已提交，请查询会话进度"
+    }
+
+
+# 上传文件分块写入磁盘的块大小
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(file_path):
+    """分块读取文件计算 SHA-256（十六进制）"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ArtifactStore:
+    """内容寻址的制品存储 - 以内容的 SHA-256 作为制品ID，相同内容只保存一份，引用计数归零时删除
+
+    put_* 返回的制品带有一个引用，由调用方持有或转交给会话
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.refs = {}  # 制品ID -> 引用计数
+        self.lock = threading.Lock()
+        self.created = time.time()  # 早于该时间的临时文件是上次运行遗留的
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, artifact_id):
+        """制品文件路径"""
+        if not isinstance(artifact_id, str) or not re.fullmatch(r"[0-9a-f]{64}", artifact_id):
+            raise KeyError(artifact_id)
+        return os.path.join(self.root, artifact_id[:2], artifact_id)
+
+    def exists(self, artifact_id):
+        try:
+            return os.path.exists(self.path(artifact_id))
+        except KeyError:
+            return False
+
+    def temp_path(self):
+        return os.path.join(self.root, f"tmp_{uuid.uuid4().hex}")
+
+    def commit(self, temp_path, artifact_id):
+        """将已写好的临时文件登记为制品（已有相同内容时丢弃临时文件）"""
+        path = self.path(artifact_id)
+        with self.lock:
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+            self.refs[artifact_id] = self.refs.get(artifact_id, 0) + 1
+        return artifact_id
+
+    def put_bytes(self, data):
+        """保存字节数据，返回制品ID"""
+        artifact_id = hashlib.sha256(data).hexdigest()
+        if self.exists(artifact_id):
+            return self.acquire(artifact_id)
+        temp_path = self.temp_path()
+        with open(temp_path, "wb") as f:
+            f.write(data)
+        return self.commit(temp_path, artifact_id)
+
+    def put_data_url(self, data_url):
+        """保存 base64 data URL 中的数据，返回制品ID"""
+        return self.put_bytes(base64.b64decode(data_url.split(",")[1]))
+
+    def put_file(self, file_path, move=False, artifact_id=None):
+        """保存磁盘上的文件（move 为 True 时移动原文件），返回制品ID
+
+        调用方已计算过文件的 SHA-256 时通过 artifact_id 传入，不再重复读取文件
+        """
+        artifact_id = artifact_id or file_sha256(file_path)
+
+        if self.exists(artifact_id):
+            if move:
+                os.remove(file_path)
+            return self.acquire(artifact_id)
+
+        temp_path = self.temp_path()
+        if move:
+            shutil.move(file_path, temp_path)
+        else:
+            shutil.copyfile(file_path, temp_path)
+        return self.commit(temp_path, artifact_id)
+
+    async def put_upload(self, upload):
+        """上传文件分块写入磁盘并同时计算哈希，不在内存中整体缓存，返回制品ID"""
+        digest = hashlib.sha256()
+        temp_path = self.temp_path()
+        with open(temp_path, "wb") as f:
+            while True:
+                chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                digest.update(chunk)
+        return self.commit(temp_path, digest.hexdigest())
+
+    def acquire(self, artifact_id):
+        """增加一个引用，制品不存在时抛出 KeyError"""
+        with self.lock:
+            if not os.path.exists(self.path(artifact_id)):
+                raise KeyError(artifact_id)
+            self.refs[artifact_id] = self.refs.get(artifact_id, 0) + 1
+        return artifact_id
+
+    def release(self, artifact_id):
+        """释放一个引用，引用计数归零时删除制品文件"""
+        with self.lock:
+            count = self.refs.get(artifact_id, 0) - 1
+            if count > 0:
+                self.refs[artifact_id] = count
+                return
+            self.refs.pop(artifact_id, None)
+            path = self.path(artifact_id)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def remove_orphans(self):
+        """删除没有引用的制品文件和上次运行遗留的临时文件（引用计数不持久，重启后由会话存储重新登记），返回删除的文件数"""
+        removed = 0
+        with self.lock:
+            for dir_path, _, names in os.walk(self.root):
+                for name in names:
+                    path = os.path.join(dir_path, name)
+                    if name.startswith("tmp_"):
+                        orphan = os.path.getmtime(path) < self.created
+                    else:
+                        orphan = not self.refs.get(name)
+                    if orphan:
+                        os.remove(path)
+                        removed += 1
+        return removed
+
+    def read(self, artifact_id):
+        with open(self.path(artifact_id), "rb") as f:
+            return f.read()
+
+    def info(self, artifact_id):
+        return {
+            "artifact_id": artifact_id,
+            "size": os.path.getsize(self.path(artifact_id)),
+            "refs": self.refs.get(artifact_id, 0)
+        }
+
+
+# 制品存储
+artifacts = ArtifactStore(os.path.join(OUTPUT_DIR, "artifacts"))
+
+
+def acquire_artifact(artifact_id):
+    """为请求中给出的制品ID增加引用，不存在时返回404"""
+    try:
+        return artifacts.acquire(artifact_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"制品不存在: {artifact_id}")
+
+
+def hold_artifact(session, key, artifact_id):
+    """会话持有制品引用（接管调用方已获得的引用），替换时释放原来的制品"""
+    old = session.get(key)
+    session[key] = artifact_id
+    if old:
+        artifacts.release(old)
+
+
+def hold_artifact_list(session, key, items):
+    """会话持有一组制品（列表项含 artifact_id），替换时释放原来的制品"""
+    old = session.get(key) or []
+    session[key] = items
+    for item in old:
+        artifacts.release(item["artifact_id"])
+
+
+# 会话存储: memory 为内存 LRU（超出内存预算时闲置会话换出到磁盘，重启后丢失），
+# sqlite 为 SQLite 持久化（定期写回，重启后恢复）
+SESSION_STORE = os.environ.get("SESSION_STORE", "memory")
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 24 * 3600))  # 会话闲置超过该秒数后删除
+SESSION_MEMORY_BUDGET = int(os.environ.get("SESSION_MEMORY_BUDGET", 256 * 1024 * 1024))  # 内存中会话总大小上限（字节）
+SESSION_MIN_IDLE = 60  # 闲置不足该秒数的会话不换出（请求处理中可能仍在使用）
+SESSION_SWEEP_INTERVAL = 60  # 过期和内存预算检查间隔（秒）
+SESSION_TRANSIENT_KEYS = ("stream_scanner",)  # 运行中的对象，只在内存中存在，不换出也不持久化
+SESSION_ARTIFACT_LISTS = ("qr_images", "resend_images")  # 列表项持有制品引用的字段
+
+
+def estimate_size(value, depth=0):
+    """估算对象占用的内存（字节），只统计字符串、字节和数组等主要数据"""
+    if isinstance(value, (str, bytes, bytearray)):
+        return len(value) + 50
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if depth > 8:
+        return 64
+    if isinstance(value, dict):
+        return 64 + sum(estimate_size(k, depth + 1) + estimate_size(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple, set)):
+        return 64 + sum(estimate_size(v, depth + 1) for v in value)
+    if hasattr(value, "__dict__"):
+        return estimate_size(vars(value), depth + 1)
+    return 32
+
+
+def session_size(session):
+    """估算会话占用的内存"""
+    return sum(estimate_size(value) for key, value in session.items() if key not in SESSION_TRANSIENT_KEYS)
+
+
+def session_artifacts(session):
+    """会话持有引用的制品ID"""
+    for key, value in session.items():
+        if key.endswith("_artifact") and value:
+            yield value
+        elif key in SESSION_ARTIFACT_LISTS:
+            for item in value or []:
+                yield item["artifact_id"]
+    for info in session.get("restored_transfers", {}).values():
+        yield info["artifact_id"]
+
+
+def dump_session(session):
+    """序列化会话（不含运行中的对象）"""
+    return pickle.dumps({key: value for key, value in session.items() if key not in SESSION_TRANSIENT_KEYS},
+                        protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SessionStore:
+    """会话存储 - 按字典方式使用，内存中的会话按最近访问排序（LRU）
+
+    闲置超过 TTL 的会话被删除并释放持有的制品；内存中会话总大小超出预算时，
+    最久未访问的闲置会话换出到后端，再次访问时载入。处理中的会话不换出也不过期。
+    子类实现换出会话的保存、载入和删除；后端在首次使用时才打开，
+    只导入模块的进程（如 spawn 启动的解码进程）不会清理或载入会话。
+    会话锁保护会话的写入和序列化: 序列化前取得会话锁，会话转入处理中状态也在会话锁内进行
+    """
+    name = None
+
+    def __init__(self, ttl=SESSION_TTL, memory_budget=SESSION_MEMORY_BUDGET):
+        self.ttl = ttl
+        self.memory_budget = memory_budget
+        self.cache = OrderedDict()  # 会话ID -> 会话（内存中，按访问顺序）
+        self.sizes = {}  # 会话ID -> 估算大小（检查时更新）
+        self.accessed = {}  # 会话ID -> 最近访问时间（包括已换出的会话）
+        self.lock = threading.RLock()
+        self.session_locks = {}  # 会话ID -> 会话锁
+        self.opened = False
+        self.sweeper = None
+        self.evicted = 0  # 换出次数
+        self.loaded = 0  # 载入次数
+        self.expired = 0  # 过期删除的会话数
+
+    def open(self):
+        """打开后端（首次使用时调用）"""
+
+    def ensure_open(self):
+        """打开后端，并清理不被任何会话、上传或客户端引用的制品文件"""
+        with self.lock:
+            if not self.opened:
+                self.open()
+                self.opened = True
+                removed = artifacts.remove_orphans()
+                if removed:
+                    logging.info(f"已删除 {removed} 个无引用的制品文件")
+
+    def session_lock(self, session_id):
+        with self.lock:
+            return self.session_locks.setdefault(session_id, threading.RLock())
+
+    def save(self, session_id, session):
+        raise NotImplementedError
+
+    def load(self, session_id):
+        """载入换出的会话，不存在时返回 None"""
+        raise NotImplementedError
+
+    def discard(self, session_id):
+        raise NotImplementedError
+
+    def persist(self, now, force=False):
+        """写回内存中的会话（持久化后端实现）"""
+
+    def get(self, session_id, default=None):
+        with self.lock:
+            self.ensure_open()
+            session = self.cache.get(session_id)
+            if session is None:
+                if session_id not in self.accessed:
+                    return default
+                session = self.load(session_id)
+                if session is None:
+                    self.accessed.pop(session_id)
+                    return default
+                self.cache[session_id] = session
+                self.sizes[session_id] = session_size(session)
+                self.loaded += 1
+            self.cache.move_to_end(session_id)
+            self.accessed[session_id] = time.time()
+        return session
+
+    def __getitem__(self, session_id):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def __setitem__(self, session_id, session):
+        with self.lock:
+            self.ensure_open()
+            self.cache[session_id] = session
+            self.cache.move_to_end(session_id)
+            self.sizes[session_id] = session_size(session)
+            self.accessed[session_id] = time.time()
+            over_budget = sum(self.sizes.values()) > self.memory_budget
+        self.start_sweeper()
+        if over_budget:
+            self.sweep()
+
+    def __contains__(self, session_id):
+        self.ensure_open()
+        return session_id in self.accessed
+
+    def __len__(self):
+        self.ensure_open()
+        return len(self.accessed)
+
+    def busy(self, session_id):
+        """会话正在处理中（后台任务持有会话对象并原地修改）"""
+        session = self.cache.get(session_id)
+        return session is not None and session.get("status") == "processing"
+
+    def delete(self, session_id):
+        """删除会话，释放会话持有的制品和指向它的任务键；会话不存在时返回 None"""
+        with self.lock:
+            self.ensure_open()
+            session = self.cache.pop(session_id, None)
+            if session is None and session_id in self.accessed:
+                session = self.load(session_id)
+            self.sizes.pop(session_id, None)
+            self.accessed.pop(session_id, None)
+            self.session_locks.pop(session_id, None)
+            self.discard(session_id)
+        if session is None:
+            return None
+
+        for artifact_id in session_artifacts(session):
+            artifacts.release(artifact_id)
+        with jobs_lock:
+            for key in [key for key, owner in jobs.items() if owner == session_id]:
+                jobs.pop(key, None)
+        return session
+
+    def sweep(self):
+        """删除过期会话；内存超出预算时按 LRU 顺序换出闲置会话"""
+        now = time.time()
+        with self.lock:
+            self.ensure_open()
+            for session_id, session in self.cache.items():
+                self.sizes[session_id] = session_size(session)
+
+            expired = [session_id for session_id, accessed in self.accessed.items()
+                       if now - accessed > self.ttl and not self.busy(session_id)]
+            for session_id in expired:
+                self.delete(session_id)
+            self.expired += len(expired)
+
+            used = sum(self.sizes.values())
+            for session_id in list(self.cache):
+                if used <= self.memory_budget:
+                    break
+                if now - self.accessed[session_id] < SESSION_MIN_IDLE:
+                    continue
+                with self.session_lock(session_id):
+                    if self.busy(session_id):
+                        continue
+                    self.save(session_id, self.cache.pop(session_id))
+                used -= self.sizes.pop(session_id)
+                self.evicted += 1
+
+            self.persist(now)
+
+    def start_sweeper(self):
+        """首次写入会话时启动定期检查线程"""
+        with self.lock:
+            if self.sweeper is None:
+                self.sweeper = threading.Thread(target=self.run_sweeper, name="session-sweeper", daemon=True)
+                self.sweeper.start()
+
+    def run_sweeper(self):
+        while True:
+            time.sleep(SESSION_SWEEP_INTERVAL)
+            try:
+                self.sweep()
+                expire_uploads()
+                expire_artifact_holds()
+            except Exception as e:
+                logging.warning(f"会话检查失败: {str(e)}")
+
+    def close(self):
+        """进程退出时写回内存中的会话"""
+        with self.lock:
+            if self.opened:
+                self.persist(time.time(), force=True)
+
+    def stats(self):
+        with self.lock:
+            self.ensure_open()
+            return {
+                "backend": self.name,
+                "sessions": len(self.accessed),
+                "in_memory": len(self.cache),
+                "memory_bytes": sum(self.sizes.values()),
+                "memory_budget": self.memory_budget,
+                "ttl": self.ttl,
+                "evicted": self.evicted,
+                "loaded": self.loaded,
+                "expired": self.expired
+            }
+
+
+class MemorySessionStore(SessionStore):
+    """内存会话存储 - 换出的会话以 pickle 文件保存在磁盘上，进程重启后丢失"""
+    name = "memory"
+
+    def __init__(self, root, **kwargs):
+        super().__init__(**kwargs)
+        self.root = root
+
+    def open(self):
+        # 上次运行换出的会话已失效（制品引用计数不持久）
+        shutil.rmtree(self.root, ignore_errors=True)
+        os.makedirs(self.root, exist_ok=True)
+
+    def spill_path(self, session_id):
+        return os.path.join(self.root, f"{session_id}.pkl")
+
+    def save(self, session_id, session):
+        temp_path = self.spill_path(session_id) + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(dump_session(session))
+        os.replace(temp_path, self.spill_path(session_id))
+
+    def load(self, session_id):
+        try:
+            with open(self.spill_path(session_id), "rb") as f:
+                session = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        os.remove(self.spill_path(session_id))
+        return session
+
+    def discard(self, session_id):
+        try:
+            os.remove(self.spill_path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class SqliteSessionStore(SessionStore):
+    """SQLite 会话存储 - 内存中的会话定期写回数据库；重启后恢复会话，
+    并重新登记会话持有的制品引用和任务键
+    """
+    name = "sqlite"
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.db = None
+        self.saved = {}  # 会话ID -> 最近写回时间
+
+    def open(self):
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, accessed REAL, data BLOB)")
+
+        for session_id, accessed, data in self.db.execute("SELECT id, accessed, data FROM sessions"):
+            session = pickle.loads(data)
+            self.accessed[session_id] = self.saved[session_id] = accessed
+            for artifact_id in session_artifacts(session):
+                try:
+                    artifacts.acquire(artifact_id)
+                except KeyError:
+                    logging.warning(f"会话 {session_id} 的制品已丢失: {artifact_id}")
+            if session.get("job_key"):
+                with jobs_lock:
+                    jobs[session["job_key"]] = session_id
+
+    def save(self, session_id, session):
+        now = time.time()
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO sessions (id, accessed, data) VALUES (?, ?, ?)",
+                            (session_id, self.accessed.get(session_id, now), dump_session(session)))
+        self.saved[session_id] = now
+
+    def load(self, session_id):
+        row = self.db.execute("SELECT data FROM sessions WHERE id = ?", (session_id,)).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def discard(self, session_id):
+        with self.db:
+            self.db.execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+        self.saved.pop(session_id, None)
+
+    def persist(self, now, force=False):
+        """写回上次写回以来访问过的会话；请求处理中可能在访问后才修改会话，最近访问的会话下一轮再写回一次"""
+        for session_id, session in self.cache.items():
+            if not force and self.accessed[session_id] <= self.saved.get(session_id, 0) - SESSION_MIN_IDLE:
+                continue
+            with self.session_lock(session_id):
+                if not self.busy(session_id):
+                    self.save(session_id, session)
+
+
+def create_session_store():
+    """按 SESSION_STORE 创建会话存储"""
+    if SESSION_STORE == "sqlite":
+        return SqliteSessionStore(os.path.join(OUTPUT_DIR, "sessions.db"))
+    if SESSION_STORE != "memory":
+        raise ValueError(f"未知的会话存储: {SESSION_STORE}")
+    return MemorySessionStore(os.path.join(OUTPUT_DIR, "sessions"))
 
 
 # 会话状态存储
-sessions = {}
+sessions = create_session_store()
+atexit.register(sessions.close)
+
+
+class ResumableUpload:
+    """断点续传上传 - 预分配稀疏文件，按任意顺序写入字节范围并记录已收到的范围"""
+
+    def __init__(self, upload_id, size, file_name=None):
+        self.upload_id = upload_id
+        self.size = size
+        self.file_name = file_name
+        ext = os.path.splitext(file_name or "")[1]
+        self.path = os.path.join(OUTPUT_DIR, f"{upload_id}_upload{ext}")
+        self.ranges = []  # 已收到的字节范围 [起始, 结束)，有序且不重叠
+        self.completed = False
+        self.artifact_id = None  # 完成后文件移入制品存储，上传持有一个引用
+        self.accessed = time.time()
+
+        # 稀疏文件: 只设置长度，不实际写入数据
+        with open(self.path, "wb") as f:
+            f.truncate(size)
+
+    def add_range(self, start, end):
+        """记录已收到的范围 [start, end)，与相邻范围合并"""
+        merged = []
+        for s, e in sorted(self.ranges + [[start, end]]):
+            if merged and s <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], e)
+            else:
+                merged.append([s, e])
+        self.ranges = merged
+
+    @property
+    def contiguous(self):
+        """从文件开头起连续收到的字节数"""
+        if self.ranges and self.ranges[0][0] == 0:
+            return self.ranges[0][1]
+        return 0
+
+    @property
+    def received(self):
+        return sum(e - s for s, e in self.ranges)
+
+    def missing(self):
+        """尚未收到的字节范围 [起始, 结束)"""
+        gaps = []
+        position = 0
+        for s, e in self.ranges:
+            if s > position:
+                gaps.append([position, s])
+            position = e
+        if position < self.size:
+            gaps.append([position, self.size])
+        return gaps
+
+    def store(self, artifact_id):
+        """上传完成: 文件移入制品存储（artifact_id 为已计算的 SHA-256），之后的请求引用同一制品，不再复制"""
+        self.artifact_id = artifacts.put_file(self.path, move=True, artifact_id=artifact_id)
+        self.path = artifacts.path(self.artifact_id)
+        self.completed = True
+
+    def acquire(self):
+        """为使用已完成上传的请求增加一个制品引用"""
+        return artifacts.acquire(self.artifact_id)
+
+    def discard(self):
+        """删除上传: 已完成时释放上传持有的制品引用，否则删除已收到的数据"""
+        if self.artifact_id:
+            artifacts.release(self.artifact_id)
+            self.artifact_id = None
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+
+    def info(self):
+        return {
+            "upload_id": self.upload_id,
+            "size": self.size,
+            "received": self.received,
+            "contiguous": self.contiguous,
+            "missing": self.missing(),
+            "completed": self.completed
+        }
 
 
-@app.post("/serialize")
-async def serialize_data(request: SerializeRequest):
+def get_upload(upload_id, completed=False):
+    """获取断点续传上传；completed 为 True 时要求已完成"""
+    upload = uploads.get(upload_id)
+    if not upload:
+        raise HTTPException(status_code=404, detail="上传不存在")
+    if completed and not upload.completed:
+        raise HTTPException(status_code=409, detail="上传尚未完成")
+    upload.accessed = time.time()
+    return upload
+
+
+def expire_uploads():
+    """删除闲置超过 SESSION_TTL 的上传（客户端不一定会调用 DELETE /uploads）"""
+    now = time.time()
+    for upload_id, upload in list(uploads.items()):
+        if now - upload.accessed > SESSION_TTL:
+            uploads.pop(upload_id, None)
+            upload.discard()
+
+
+# 建议客户端每次上传的字节范围大小
+UPLOAD_RANGE_SIZE = 4 * 1024 * 1024
+
+# 边上传边扫描: 等待数据时预读的字节数和最长等待时间
+UPLOAD_READ_AHEAD = 4 * 1024 * 1024
+UPLOAD_WAIT_TIMEOUT = 300
+
+
+def wait_for_upload(upload, position):
+    """等待上传从文件开头连续到达 position（已完成时立即返回），在后台任务中调用"""
+    deadline = time.monotonic() + UPLOAD_WAIT_TIMEOUT
+    position = min(upload.size, int(position))
+    while not upload.completed and upload.contiguous < position:
+        if time.monotonic() > deadline:
+            raise ValueError("等待上传数据超时")
+        time.sleep(0.2)
+
+
+@app.post("/uploads")
+async def create_upload(request: UploadCreateRequest):
+    """创建断点续传上传"""
+    if request.size <= 0:
+        raise HTTPException(status_code=400, detail="文件大小无效")
+
+    upload_id = str(uuid.uuid4())
+    uploads[upload_id] = ResumableUpload(upload_id, request.size, request.file_name)
+    sessions.start_sweeper()
+    return {**uploads[upload_id].info(), "range_size": UPLOAD_RANGE_SIZE}
+
+
+@app.put("/uploads/{upload_id}")
+async def upload_range(upload_id: str, request: Request):
+    """上传一个字节范围
+
+    请求头 Content-Range: bytes 起始-结束/总长，X-Checksum-SHA256 为该范围数据的 SHA-256。
+    范围可按任意顺序上传，校验失败的范围不会被记录，重新上传即可
+    """
+    upload = get_upload(upload_id)
+    if upload.completed:
+        raise HTTPException(status_code=409, detail="上传已完成")
+
+    match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", request.headers.get("content-range", "").strip())
+    if not match:
+        raise HTTPException(status_code=400, detail="缺少或无效的 Content-Range")
+    start, end = int(match.group(1)), int(match.group(2)) + 1
+    if end <= start or end > upload.size or match.group(3) not in ("*", str(upload.size)):
+        raise HTTPException(status_code=400, detail="字节范围超出文件大小")
+
+    checksum = request.headers.get("x-checksum-sha256", "").strip().lower()
+    if not checksum:
+        raise HTTPException(status_code=400, detail="缺少范围校验和 X-Checksum-SHA256")
+
+    # 先写入临时文件，校验通过后再写入稀疏文件，避免损坏已收到的数据
+    digest = hashlib.sha256()
+    with tempfile.SpooledTemporaryFile(max_size=UPLOAD_CHUNK_SIZE) as spool:
+        async for chunk in request.stream():
+            if spool.tell() + len(chunk) > end - start:
+                raise HTTPException(status_code=400, detail="请求体超出字节范围")
+            spool.write(chunk)
+            digest.update(chunk)
+
+        if spool.tell() != end - start:
+            raise HTTPException(status_code=400, detail="请求体长度与字节范围不符")
+        if digest.hexdigest() != checksum:
+            raise HTTPException(status_code=400, detail="范围校验和不匹配")
+
+        spool.seek(0)
+        with open(upload.path, "r+b") as f:
+            f.seek(start)
+            shutil.copyfileobj(spool, f, UPLOAD_CHUNK_SIZE)
+
+    upload.add_range(start, end)
+    return upload.info()
+
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_status(upload_id: str):
+    """查询上传进度及缺少的字节范围，用于断点续传"""
+    return get_upload(upload_id).info()
+
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, request: Optional[UploadFinalizeRequest] = None):
+    """完成上传: 检查所有范围均已收到，可选校验整个文件的 SHA-256"""
+    upload = get_upload(upload_id)
+    missing = upload.missing()
+    if missing:
+        raise HTTPException(status_code=409, detail=f"上传不完整，缺少字节范围 {missing}")
+
+    # 整个文件只计算一次哈希，既用于校验也作为制品ID；大文件放到任务线程池中计算，不阻塞事件循环
+    artifact_id = upload.artifact_id or await asyncio.get_running_loop().run_in_executor(
+        get_job_pool(), file_sha256, upload.path)
+    if request and request.sha256 and artifact_id != request.sha256.lower():
+        raise HTTPException(status_code=400, detail="文件校验和不匹配")
+
+    # 计算哈希期间上传可能已被删除，或并发的 finalize 已经完成
+    if uploads.get(upload_id) is not upload:
+        raise HTTPException(status_code=404, detail="上传不存在")
+    if not upload.completed:
+        upload.store(artifact_id)
+    return upload.info()
+
+
+@app.delete("/uploads/{upload_id}")
+async def delete_upload(upload_id: str):
+    """放弃上传并删除已收到的数据"""
+    upload = get_upload(upload_id)
+    uploads.pop(upload_id, None)
+    upload.discard()
+    return {"message": "上传已删除"}
+
+
+# 客户端通过 POST /artifacts 获得的引用: 引用ID -> (制品ID, 创建时间)（客户端只能释放自己持有的引用）
+artifact_holds = {}
+
+
+def expire_artifact_holds():
+    """释放创建超过 SESSION_TTL 的客户端引用（与上传相同的期限）"""
+    now = time.time()
+    for hold_id, (artifact_id, created) in list(artifact_holds.items()):
+        if now - created > SESSION_TTL and artifact_holds.pop(hold_id, None):
+            artifacts.release(artifact_id)
+
+
+@app.post("/artifacts")
+async def create_artifact(file: UploadFile = File(...)):
+    """上传文件到制品存储，相同内容只保存一份；返回的制品ID可传给各接口代替内联数据
+
+    客户端持有的引用在 SESSION_TTL 后自动释放
+    """
+    artifact_id = await artifacts.put_upload(file)
+    hold_id = str(uuid.uuid4())
+    artifact_holds[hold_id] = (artifact_id, time.time())
+    sessions.start_sweeper()
+    return {**artifacts.info(artifact_id), "hold_id": hold_id, "expires_in": SESSION_TTL}
+
+
+@app.get("/artifacts/{artifact_id}")
+async def download_artifact(artifact_id: str):
+    if not artifacts.exists(artifact_id):
+        raise HTTPException(status_code=404, detail="制品不存在")
+    return FileResponse(artifacts.path(artifact_id), media_type="application/octet-stream")
+
+
+@app.delete("/artifacts/{artifact_id}")
+async def release_artifact(artifact_id: str, hold_id: str):
+    """释放 POST /artifacts 返回的引用（仍被会话使用的制品不会被删除）"""
+    if artifact_holds.get(hold_id, (None, None))[0] != artifact_id:
+        raise HTTPException(status_code=404, detail="引用不存在")
+    artifact_holds.pop(hold_id)
+    artifacts.release(artifact_id)
+    return {"message": "制品引用已释放"}
+
+
+def new_serialize_session(mode, version):
+    """创建序列化会话"""
     session_id = str(uuid.uuid4())
     sessions[session_id] = {
         "status": "processing",
         "progress": 0,
         "message": "开始序列化...",
-        "serialized_data": None,
-        "mode": request.mode,
-        "file_path": None,
-        "version": request.version
+        "mode": mode,
+        "version": version,
+        "source_artifact": None,
+        "base_artifact": None,
+        "serialized_artifact": None
     }
+    return session_id
+
+
+def run_serialize(session_id, source_artifact, base_artifact=None, region=None, sheet_name=None,
+                  source_name=None):
+    """按会话的模式序列化制品中的文件（会话接管传入的制品引用）"""
+    session = sessions[session_id]
+    hold_artifact(session, "source_artifact", source_artifact)
+    if base_artifact:
+        hold_artifact(session, "base_artifact", base_artifact)
+
+    mode, version = session["mode"], session["version"]
+    file_path = artifacts.path(source_artifact)
+    source_name = source_name or f"{session_id}_source{'.xlsx' if mode == 'region' else '.bin'}"
+    # 序列化结果保存在制品存储中，不再另存 .qrdat 副本
+    processor = QRProcessor(OUTPUT_DIR, save_copies=False)
+
+    if mode == "region":
+        session["message"] = "序列化Excel区域..."
+        # 制品文件没有扩展名，以文件对象交给 openpyxl
+        with open(file_path, "rb") as f:
+            serialized_data = processor.serialize_excel_region(
+                f,
+                region or "A1:D10",
+                sheet_name=sheet_name,
+                version=version,
+                source_name=source_name
+            )
+    elif mode == "delta":
+        session["message"] = "增量序列化..."
+        serialized_data = processor.serialize_delta(
+            file_path,
+            artifacts.path(base_artifact),
+            version=version,
+            progress_callback=lambda p, m: session.update({"progress": int(p), "message": m}),
+            source_name=source_name
+        )
+    else:
+        session["message"] = "序列化文件..."
+        serialized_data = processor.serialize_file(
+            file_path,
+            version=version
+        )
 
-    try:
-        # 处理文件上传
-        file_data = request.file_path
-        if not file_data:
-            raise HTTPException(status_code=400, detail="未提供文件数据")
+    hold_artifact(session, "serialized_artifact", artifacts.put_bytes(serialized_data))
+    update_session(
+        session_id,
+        status="completed",
+        progress=100,
+        message="序列化完成",
+        result=serialize_result(session_id)
+    )
+
+
+def serialize_result(session_id, reused=False):
+    """序列化会话的响应内容"""
+    session = sessions[session_id]
+    if not session.get("serialized_artifact"):
+        return {
+            "session_id": session_id,
+            "status": session["status"],
+            "reused": reused,
+            "message": "相同的序列化任务正在进行"
+        }
+    return {
+        "session_id": session_id,
+        "status": "completed",
+        "data_size": artifacts.info(session["serialized_artifact"])["size"],
+        "artifact_id": session["serialized_artifact"],
+        "reused": reused,
+        "message": "复用已有的序列化结果" if reused else "序列化成功"
+    }
 
-        # 保存文件到临时目录
-        file_ext = ".xlsx" if request.mode == "region" else ".bin"
-        file_path = os.path.join(OUTPUT_DIR, f"{session_id}_source{file_ext}")
-        with open(file_path, "wb") as f:
-            f.write(base64.b64decode(file_data.split(",")[1]))
 
-        processor = QRProcessor(OUTPUT_DIR)
+def serialize_job(source_artifact, base_artifact, mode, version, region=None, sheet_name=None, source_name=None):
+    """序列化任务 - 相同输入和参数的请求复用进行中或已完成的会话，否则新建会话在后台执行
 
-        if request.mode == "region":
-            sessions[session_id]["message"] = "序列化Excel区域..."
-            serialized_data = processor.serialize_excel_region(
-                file_path,
-                request.region or "A1:D10",
-                sheet_name=request.sheet_name,
-                version=request.version
-            )
-        else:
-            sessions[session_id]["message"] = "序列化文件..."
-            serialized_data = processor.serialize_file(
-                file_path,
-                version=request.version
-            )
+    传入的制品引用由会话接管（复用时释放）
+    """
+    region = region or "A1:D10"
+    key = job_key(
+        "serialize", mode, version, source_artifact,
+        base_artifact if mode == "delta" else None,
+        region if mode == "region" else None,
+        sheet_name if mode == "region" else None
+    )
 
-        sessions[session_id].update({
-            "status": "completed",
-            "progress": 100,
-            "message": "序列化完成",
-            "serialized_data": base64.b64encode(serialized_data).decode(),
-            "file_path": file_path
-        })
+    with jobs_lock:
+        owner = jobs.get(key)
+    session = sessions.get(owner)
+    if session and session.get("job_key") == key and \
+            (session.get("serialized_artifact") or session["status"] == "processing"):
+        artifacts.release(source_artifact)
+        if base_artifact:
+            artifacts.release(base_artifact)
+        return serialize_result(owner, reused=True)
 
-        return JSONResponse(content={
-            "session_id": session_id,
-            "data_size": len(serialized_data),
-            "message": "序列化成功"
-        })
+    session_id = new_serialize_session(mode, version)
+    sessions[session_id]["job_key"] = key
+    with jobs_lock:
+        jobs[key] = session_id
 
-    except Exception as e:
-        sessions[session_id].update({
-            "status": "error",
-            "message": f"序列化失败: {str(e)}"
+    return submit_job(session_id, "序列化失败", run_serialize,
+                      session_id, source_artifact, base_artifact, region, sheet_name, source_name)
+
+
+@app.post("/serialize")
+async def serialize_data(request: SerializeRequest):
+    # 处理文件上传
+    if not (request.file_path or request.upload_id or request.artifact_id):
+        raise HTTPException(status_code=400, detail="未提供文件数据")
+    if request.mode == "delta" and not (request.base_file or request.base_upload_id or request.base_artifact_id):
+        raise HTTPException(status_code=400, detail="增量模式需要提供基准文件")
+
+    upload = get_upload(request.upload_id, completed=True) if request.upload_id else None
+    base_upload = get_upload(request.base_upload_id, completed=True) if request.base_upload_id else None
+
+    # 文件存入制品存储（相同内容只保存一份），制品ID即输入的哈希
+    if request.artifact_id:
+        source_artifact = acquire_artifact(request.artifact_id)
+    elif upload:
+        source_artifact = upload.acquire()
+    else:
+        source_artifact = artifacts.put_data_url(request.file_path)
+
+    base_artifact = None
+    try:
+        if request.mode == "delta":
+            if request.base_artifact_id:
+                base_artifact = acquire_artifact(request.base_artifact_id)
+            elif base_upload:
+                base_artifact = base_upload.acquire()
+            else:
+                base_artifact = artifacts.put_data_url(request.base_file)
+    except Exception:
+        artifacts.release(source_artifact)
+        raise
+
+    return JSONResponse(content=serialize_job(
+        source_artifact, base_artifact, request.mode, request.version,
+        request.region, request.sheet_name, upload.file_name if upload else None))
+
+
+@app.post("/serialize-upload")
+async def serialize_upload(
+        file: UploadFile = File(...),
+        mode: str = Form(...),
+        base_file: Optional[UploadFile] = File(None),
+        region: Optional[str] = Form(None),
+        sheet_name: Optional[str] = Form(None),
+        version: int = Form(8)
+):
+    """/serialize 的 multipart 版本 - 上传文件直接分块写入制品存储，不经过 base64"""
+    if mode == "delta" and not base_file:
+        raise HTTPException(status_code=400, detail="增量模式需要提供基准文件")
+
+    source_artifact = await artifacts.put_upload(file)
+    base_artifact = await artifacts.put_upload(base_file) if mode == "delta" else None
+
+    return JSONResponse(content=serialize_job(
+        source_artifact, base_artifact, mode, version, region, sheet_name, file.filename))
+
+
+def qr_result(session_id, images_key, selection=None, reused=False):
+    """二维码生成的响应内容"""
+    qr_files = sessions[session_id][images_key]
+
+    # 返回二维码预览
+    previews = []
+    # 只返回前3个预览；补发时数量少，全部返回
+    for qr in (qr_files if selection else qr_files[:3]):
+        previews.append({
+            "name": qr["name"],
+            "artifact_id": qr["artifact_id"],
+            "data": base64.b64encode(artifacts.read(qr["artifact_id"])).decode()
         })
-        raise HTTPException(status_code=500, detail=str(e))
+
+    return {
+        "session_id": session_id,
+        "status": "completed",
+        "count": len(qr_files),
+        "chunks": selection,
+        "previews": previews,
+        "reused": reused,
+        "message": f"复用已生成的 {len(qr_files)} 个二维码" if reused else f"成功生成 {len(qr_files)} 个二维码"
+    }
 
 
 @app.post("/generate-qr")
@@ -646,62 +3011,102 @@ async def generate_qr(request: QRGenerationRequest):
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
-    if session["status"] != "completed" or not session.get("serialized_data"):
+    if not session.get("serialized_artifact"):
         raise HTTPException(status_code=400, detail="请先完成序列化")
 
-    try:
+    # 补发指定分块：沿用首次生成时的分块大小，保证分块编号一致
+    selection = None
+    max_chunk_size = request.max_chunk_size
+    if request.chunks or request.ranges:
+        max_chunk_size = session.get("max_chunk_size", request.max_chunk_size)
+        processor = QRProcessor(OUTPUT_DIR)
+        # 分块规划要读取整份序列化数据并逐块 base64 编码，放到任务线程池中执行，不阻塞事件循环
+        plan = await asyncio.get_running_loop().run_in_executor(
+            get_job_pool(), processor.plan_qr_chunks,
+            artifacts.read(session["serialized_artifact"]), max_chunk_size, session["version"], session["mode"])
+        if plan[0][0] == "single":
+            raise HTTPException(status_code=400, detail="数据只有单个二维码，无需指定分块")
+        try:
+            selection = processor.parse_chunk_indices(
+                list(request.chunks or []) + ([request.ranges] if request.ranges else []),
+                len(plan)
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    # 相同数据和参数的生成任务进行中或已完成时直接复用
+    images_key = "resend_images" if selection else "qr_images"
+    key = job_key("generate-qr", session["serialized_artifact"], max_chunk_size, tuple(selection or ()))
+    if session.get("qr_running") == key:
+        return JSONResponse(content={
+            "session_id": request.session_id,
+            "status": "processing",
+            "reused": True,
+            "message": "相同的二维码生成任务正在进行"
+        })
+    if session.get("qr_jobs", {}).get(images_key) == key and session.get(images_key):
+        return JSONResponse(content=qr_result(request.session_id, images_key, selection, reused=True))
+
+    with sessions.session_lock(request.session_id):
+        if session["status"] == "processing":
+            raise HTTPException(status_code=409, detail="会话正在处理中")
+
         session["status"] = "processing"
         session["progress"] = 0
         session["message"] = "开始生成二维码..."
+        session["qr_running"] = key
+
+    return JSONResponse(content=submit_job(
+        request.session_id, "生成失败", run_generate_qr,
+        request.session_id, max_chunk_size, selection, images_key, key))
 
-        serialized_data = base64.b64decode(session["serialized_data"])
-        processor = QRProcessor(OUTPUT_DIR)
 
+def run_generate_qr(session_id, max_chunk_size, selection, images_key, key):
+    """生成二维码（后台任务），完成后结果写入会话"""
+    session = sessions[session_id]
+    processor = QRProcessor(OUTPUT_DIR)
+
+    try:
         # 生成二维码
         qr_images = processor.create_qr_codes(
-            serialized_data,
-            max_size=request.max_chunk_size,
+            artifacts.read(session["serialized_artifact"]),
+            max_size=max_chunk_size,
             version=session["version"],
-            mode=session["mode"]
+            mode=session["mode"],
+            indices=selection
         )
 
-        # 保存二维码图片
+        # 二维码图片存入制品存储（相同分块的图片只保存一份），下载时按分块位置命名
+        positions = [i - 1 for i in selection] if selection else range(len(qr_images))
         qr_files = []
-        for i, (name, img) in enumerate(qr_images):
-            img_path = os.path.join(OUTPUT_DIR, f"{request.session_id}_qr_{i}.png")
-            img.save(img_path)
+        for i, (position, (name, img)) in enumerate(zip(positions, qr_images)):
+            buffer = io.BytesIO()
+            img.save(buffer, "PNG")
             qr_files.append({
                 "name": name,
-                "path": img_path
+                "file_name": f"{session_id}_qr_{position}.png",
+                "artifact_id": artifacts.put_bytes(buffer.getvalue())
             })
 
-            session["progress"] = int((i + 1) / len(qr_images) * 100)
-            session["message"] = f"生成二维码 {i + 1}/{len(qr_images)}"
-            await asyncio.sleep(0.01)  # 让出控制权
-
-        session["qr_images"] = qr_files
-        session["status"] = "completed"
-        session["message"] = "二维码生成完成"
-
-        # 返回二维码预览
-        previews = []
-        for qr in qr_files[:3]:  # 只返回前3个预览
-            with open(qr["path"], "rb") as f:
-                previews.append({
-                    "name": qr["name"],
-                    "data": base64.b64encode(f.read()).decode()
-                })
+            update_session(
+                session_id,
+                progress=int((i + 1) / len(qr_images) * 100),
+                message=f"生成二维码 {i + 1}/{len(qr_images)}"
+            )
 
-        return JSONResponse(content={
-            "count": len(qr_files),
-            "previews": previews,
-            "message": f"成功生成 {len(qr_files)} 个二维码"
-        })
+    finally:
+        session.pop("qr_running", None)
 
-    except Exception as e:
-        session["status"] = "error"
-        session["message"] = f"生成失败: {str(e)}"
-        raise HTTPException(status_code=500, detail=str(e))
+    hold_artifact_list(session, images_key, qr_files)
+    if not selection:
+        session["max_chunk_size"] = max_chunk_size
+    session.setdefault("qr_jobs", {})[images_key] = key
+    update_session(
+        session_id,
+        status="completed",
+        message="二维码生成完成",
+        result=qr_result(session_id, images_key, selection)
+    )
 
 
 from fastapi import UploadFile, File
@@ -720,22 +3125,25 @@ async def get_sheets(file: UploadFile = File(...)):
         )
 
     try:
-        # 方法1：直接从内存读取（推荐）
-        contents = await file.read()
+        # 快速路径：只读取 xl/workbook.xml，不解析单元格
+        processor = QRProcessor(OUTPUT_DIR)
         try:
-            wb = load_workbook(io.BytesIO(contents))
-            return {"sheets": wb.sheetnames}
-        except InvalidFileException:
-            # 方法2：如果内存读取失败，尝试临时文件方式
-            with tempfile.NamedTemporaryFile(suffix=".xlsx", delete=False) as tmp:
-                tmp.write(contents)
-                tmp_path = tmp.name
+            index = processor.read_sheet_index(file.file)
+            return {
+                "sheets": [s["name"] for s in index["sheets"]],
+                "active": index["active"],
+                "sheet_info": index["sheets"]
+            }
+        except (zipfile.BadZipFile, KeyError, ET.ParseError) as e:
+            logging.warning(f"工作簿索引读取失败，回退到只读加载: {str(e)}")
 
-            try:
-                wb = load_workbook(tmp_path)
-                return {"sheets": wb.sheetnames}
-            finally:
-                os.unlink(tmp_path)
+        # 回退：只读模式加载（不会构建全部单元格对象）
+        file.file.seek(0)
+        wb = load_workbook(file.file, read_only=True)
+        try:
+            return {"sheets": wb.sheetnames}
+        finally:
+            wb.close()
 
     except Exception as e:
         raise HTTPException(
@@ -744,177 +3152,775 @@ async def get_sheets(file: UploadFile = File(...)):
         )
 
 
+@app.post("/sheet-preview")
+async def sheet_preview(
+        file: UploadFile = File(...),
+        sheet_name: Optional[str] = Form(None),
+        region: Optional[str] = Form(None),
+        offset: int = Form(0),
+        limit: int = Form(20)
+):
+    """检测已用区域并分页预览，便于选择序列化区域"""
+    if not file.filename.lower().endswith(('.xlsx', '.xlsm', '.xltx', '.xltm')):
+        raise HTTPException(
+            status_code=400,
+            detail="仅支持 .xlsx, .xlsm, .xltx, .xltm 格式的Excel文件"
+        )
+
+    offset = max(0, offset)
+    limit = max(1, min(limit, 200))
+
+    try:
+        processor = QRProcessor(OUTPUT_DIR)
+
+        # 各sheet的已用区域（只读dimension，不扫描）
+        used_ranges = {}
+        try:
+            index = processor.read_sheet_index(file.file)
+            sheet_name = sheet_name or index["active"]
+            for sheet in index["sheets"]:
+                used_ranges[sheet["name"]] = sheet["dimension"]
+        except (zipfile.BadZipFile, KeyError, ET.ParseError):
+            pass
+
+        # 当前sheet的已用区域（dimension不可信时扫描）
+        used = processor.detect_used_range(file.file, sheet_name)
+        used_ranges[used["sheet"]] = used["range"]
+
+        preview = processor.preview_sheet(
+            file.file,
+            sheet_name=used["sheet"],
+            region=region or used["range"],
+            offset=offset,
+            limit=limit
+        )
+
+        return {
+            "sheet": used["sheet"],
+            "used_range": used["range"],
+            "range_source": used["source"],
+            "used_ranges": used_ranges,
+            "offset": offset,
+            "limit": limit,
+            **preview
+        }
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f"预览Excel失败: {str(e)}"
+        )
+
+
 @app.get("/session/{session_id}")
-async def get_session_status(session_id: str):
+async def get_session_status(session_id: str, since: int = 0):
+    """会话状态；实时扫描会话附带第 since 个之后的新分块事件"""
     session = sessions.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
-    return JSONResponse(content={
+    content = {
         "status": session["status"],
         "progress": session["progress"],
         "message": session["message"]
-    })
+    }
 
+    # 后台任务的结果
+    if "result" in session:
+        content["result"] = session["result"]
+
+    # 扫描会话: 返回已收集和缺少的分块，便于续扫
+    assembler = session.get("assembler")
+    if assembler:
+        content.update({
+            "received": assembler.received,
+            "total": assembler.total,
+            "missing": assembler.missing(),
+            "rounds": session.get("rounds", 0)
+        })
+
+    events = session.get("events")
+    if events is not None:
+        content.update({
+            "events": events[max(since, 0):],
+            "event_count": len(events)
+        })
+
+    return JSONResponse(content=content)
+
+
+@app.delete("/session/{session_id}")
+async def delete_session(session_id: str):
+    """删除会话并释放会话持有的制品"""
+    session = sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    if session["status"] == "processing":
+        raise HTTPException(status_code=409, detail="会话正在处理中")
+    sessions.delete(session_id)
+    return {"message": "会话已删除"}
+
+
+@app.get("/session-stats")
+async def get_session_stats():
+    """会话存储的会话数、内存占用和换出/过期次数"""
+    return JSONResponse(content=sessions.stats())
+
+
+def open_scan_session(session_id, message):
+    """创建扫描会话；续扫时沿用已有会话及已收集的分块"""
+    if session_id:
+        session = sessions.get(session_id)
+        if not session or "assembler" not in session:
+            raise HTTPException(status_code=404, detail="扫描会话不存在")
+        with sessions.session_lock(session_id):
+            if session["status"] == "processing":
+                raise HTTPException(status_code=409, detail="扫描会话正在处理中")
+            session.update({
+                "status": "processing",
+                "progress": 0,
+                "message": message
+            })
+        return session_id
 
-@app.post("/scan-images")
-async def scan_images(request: ScanRequest):
     session_id = str(uuid.uuid4())
     sessions[session_id] = {
         "status": "processing",
         "progress": 0,
-        "message": "开始扫描二维码...",
-        "restored_file": None
+        "message": message,
+        "restored_artifact": None,
+        "assembler": ChunkAssembler(),
+        "base_artifact": None,
+        "rounds": 0
+    }
+    return session_id
+
+
+def save_scan_base_artifact(session_id, artifact_id):
+    """记录增量恢复用的基准文件制品（续扫时可不再上传）"""
+    hold_artifact(sessions[session_id], "base_artifact", artifact_id)
+
+
+def save_scan_base_file(session_id, base_file):
+    """保存 base64 编码的增量恢复基准文件"""
+    if base_file:
+        save_scan_base_artifact(session_id, artifacts.put_data_url(base_file))
+
+
+def finish_scan_round(session_id, new_chunks, **extra):
+    """结束一轮扫描：分块齐全时自动合并恢复，否则记录缺少的分块等待续扫
+
+    最终状态和本轮结果（附加 extra）一并写入会话
+    """
+    session = sessions[session_id]
+    assembler = session["assembler"]
+    session["rounds"] += 1
+
+    if assembler.empty:
+        raise ValueError("未找到有效二维码数据")
+
+    # 逐个传输合并恢复（已在之前轮次恢复的传输不再重复）
+    restored = session.setdefault("restored_transfers", OrderedDict())
+    transfers = []
+    errors = []
+    for key, total, values, missing in assembler.groups():
+        transfer = {"transfer_id": key, "total": total, "received": len(values), "missing": missing}
+        if missing:
+            transfer["status"] = "incomplete"
+        else:
+            if key not in restored:
+                try:
+                    session["message"] = f"恢复文件 ({key})..."
+                    info = restore_transfer(session, values)
+                except Exception as e:
+                    transfer.update(status="error", message=str(e))
+                    errors.append(f"{key}: {str(e)}")
+                    transfers.append(transfer)
+                    continue
+                # 同一批恢复的文件重名时附加传输标识
+                if any(r["file_name"] == info["file_name"] for r in restored.values()):
+                    name, ext = os.path.splitext(info["file_name"])
+                    info["file_name"] = f"{name}_{key}{ext}"
+                restored[key] = info
+            transfer.update(status="completed", **restored[key])
+        transfers.append(transfer)
+
+    if not restored and not any(t["status"] == "incomplete" for t in transfers):
+        raise ValueError(f"数据不完整: {'; '.join(errors)}" if len(errors) > 1 else "数据不完整")
+
+    # 第一个恢复的文件作为会话的恢复结果（下载时不指定传输标识即下载此文件）
+    if restored and not session.get("restored_artifact"):
+        first = next(iter(restored.values()))
+        artifacts.acquire(first["artifact_id"])
+        hold_artifact(session, "restored_artifact", first["artifact_id"])
+        session["file_name"] = first["file_name"]
+
+    result = {
+        "session_id": session_id,
+        "new_chunks": new_chunks,
+        "received": assembler.received,
+        "total": assembler.total,
+        "missing": assembler.missing(),
+        "transfers": transfers,
+        **extra
     }
 
+    if not assembler.complete:
+        incomplete = [t for t in transfers if t["status"] == "incomplete"]
+        if len(incomplete) == 1:
+            message = f"已收集 {assembler.received}/{assembler.total} 个分块，缺少分块 {incomplete[0]['missing']}"
+        else:
+            message = f"已收集 {assembler.received}/{assembler.total} 个分块，{len(incomplete)} 个传输缺少分块"
+        if restored:
+            message += f"，已恢复 {len(restored)} 个文件"
+        if errors:
+            message += f"，{len(errors)} 个无法恢复"
+        result.update(status="incomplete", message=message)
+        update_session(
+            session_id,
+            status="incomplete",
+            progress=int(assembler.received / assembler.total * 100),
+            message=message,
+            result=result
+        )
+        return result
+
+    result.update(
+        status="completed",
+        file_name=session["file_name"],
+        artifact_id=session["restored_artifact"],
+        message=("文件恢复成功" if len(restored) == 1 else f"已恢复 {len(restored)} 个文件")
+                + (f"，{len(errors)} 个无法恢复" if errors else "")
+    )
+    update_session(
+        session_id,
+        status="completed",
+        progress=100,
+        message="恢复完成",
+        result=result
+    )
+    return result
+
+
+def restore_transfer(session, values):
+    """合并一个传输的分块并恢复文件，恢复的文件移入制品存储，返回 {file_name, artifact_id}（会话持有引用）"""
+    combined = QRProcessor(OUTPUT_DIR).combine_data(values)
+    if not combined:
+        raise ValueError("数据不完整")
+
+    # 恢复的文件名只精确到秒，多个任务线程同时恢复会写到同一路径: 每次恢复使用独立的目录
+    work_dir = os.path.join(OUTPUT_DIR, f"restore_{uuid.uuid4().hex}")
+    base_artifact = session.get("base_artifact")
     try:
-        chunks = []
-        total_files = len(request.files)
+        output_path = QRProcessor(work_dir).restore(
+            combined, base_path=artifacts.path(base_artifact) if base_artifact else None)
+        return {
+            "file_name": os.path.basename(output_path),
+            "artifact_id": artifacts.put_file(output_path, move=True)
+        }
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
 
-        for i, file_data in enumerate(request.files):
-            # 解码base64图片
-            img_data = base64.b64decode(file_data.split(",")[1])
-            img = Image.open(io.BytesIO(img_data))
 
-            # 解码二维码
-            results = pyzbar.decode(img)
-            for r in results:
-                if r.type == 'QRCODE':
-                    chunks.append(r.data.decode('utf-8'))
+def validate_scan_options(ladder, decoder):
+    """校验预处理阶梯和解码后端"""
+    unknown = [stage for stage in ladder or [] if stage not in PREPROCESS_STAGES]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"未知的预处理阶段: {unknown}")
+    if decoder not in DECODER_NAMES:
+        raise HTTPException(status_code=400, detail=f"未知的解码后端: {decoder}")
 
-            sessions[session_id]["progress"] = int((i + 1) / total_files * 100)
-            sessions[session_id]["message"] = f"扫描文件 {i + 1}/{total_files}"
-            await asyncio.sleep(0.01)
 
-        if not chunks:
-            raise ValueError("未找到有效二维码数据")
+def validate_segments(segments):
+    """校验视频分段数"""
+    if segments is not None and not 1 <= segments <= VIDEO_MAX_SEGMENTS:
+        raise HTTPException(status_code=400, detail=f"分段数应在 1 到 {VIDEO_MAX_SEGMENTS} 之间")
 
-        # 合并数据
-        sessions[session_id]["message"] = "合并数据..."
-        processor = QRProcessor(OUTPUT_DIR)
-        combined = processor.combine_data(chunks)
 
-        if not combined:
-            raise ValueError("数据不完整")
+def validate_expect_transfers(expect_transfers):
+    """校验视频中的传输个数"""
+    if expect_transfers is not None and expect_transfers < 1:
+        raise HTTPException(status_code=400, detail="传输个数应至少为 1")
 
-        # 恢复文件
-        sessions[session_id]["message"] = "恢复文件..."
-        output_path = processor.restore(combined)
 
-        # 读取恢复的文件
-        with open(output_path, "rb") as f:
-            file_content = f.read()
+def run_scan_images(session_id, request: ScanRequest, paths=()):
+    """解码一轮图片并汇总分块（后台任务），结果写入会话
 
-        sessions[session_id].update({
-            "status": "completed",
-            "progress": 100,
-            "message": "恢复完成",
-            "restored_file": base64.b64encode(file_content).decode(),
-            "file_name": os.path.basename(output_path)
-        })
+    request.files 是客户端提交的 data URL；paths 是服务器解析出的制品文件路径
+    """
+    assembler = sessions[session_id]["assembler"]
+    new_chunks = 0
+    sources = list(request.files) + list(paths)
+    total_files = len(sources)
+    processor = QRProcessor(OUTPUT_DIR)
 
-        return JSONResponse(content={
-            "file_name": os.path.basename(output_path),
-            "message": "文件恢复成功"
-        })
+    # 图片在解码进程池中并行解码，按完成顺序汇总
+    done = 0
+    stages = sessions[session_id].setdefault("decode_stages", {})
+    # JPEG 照片按估算的模块尺寸先降分辨率解码
+    modules = estimate_qr_modules(request.max_chunk_size) if request.draft else None
+    # 整页多码: 记录每张图片各区域的识别结果
+    region_reports = {}
+
+    for i, decoded, stage, regions, error in processor.decode_many(
+            sources, request.ladder or None, request.decoder, modules, request.grid):
+        done += 1
+        if error:
+            logging.warning(f"图片 {i + 1} 解码失败: {error}")
+        stage = stage or "failed"
+        stages[stage] = stages.get(stage, 0) + 1
+        if regions is not None:
+            region_reports[i] = regions
+        for qr_data in decoded:
+            if assembler.add(qr_data):
+                new_chunks += 1
+
+        update_session(session_id, progress=int(done / total_files * 100), message=f"扫描文件 {done}/{total_files}")
+
+    extra = {"decode_stages": stages}
+    if request.grid:
+        sessions[session_id]["grid_regions"] = region_reports
+        extra["grid_regions"] = region_reports
+    finish_scan_round(session_id, new_chunks, **extra)
+
+
+def release_artifacts(artifact_ids):
+    """返回释放一组制品引用的函数，用作后台任务结束时的清理"""
+    return lambda: [artifacts.release(artifact_id) for artifact_id in artifact_ids]
+
+
+@app.post("/scan-images")
+async def scan_images(request: ScanRequest):
+    validate_scan_options(request.ladder, request.decoder)
+    # 客户端提交的图片只能是 data URL；服务器上的文件只能通过制品ID引用
+    if any(not source.startswith("data:") for source in request.files):
+        raise HTTPException(status_code=400, detail="files 只接受 data URL 格式的图片")
+
+    # 制品存储中的图片按路径交给解码进程，本轮结束后释放引用
+    held = []
+    base_artifact = None
+    try:
+        for artifact_id in request.artifact_ids or []:
+            held.append(acquire_artifact(artifact_id))
+        if request.base_artifact_id:
+            base_artifact = acquire_artifact(request.base_artifact_id)
+        session_id = open_scan_session(request.session_id, "开始扫描二维码...")
+    except HTTPException:
+        # 制品不存在或会话无法打开: 释放已取得的引用
+        release_artifacts([artifact_id for artifact_id in held + [base_artifact] if artifact_id])()
+        raise
+    paths = [artifacts.path(artifact_id) for artifact_id in held]
+
+    try:
+        if base_artifact:
+            save_scan_base_artifact(session_id, base_artifact)
+        else:
+            save_scan_base_file(session_id, request.base_file)
 
     except Exception as e:
+        release_artifacts(held)()
         sessions[session_id].update({
             "status": "error",
             "message": f"恢复失败: {str(e)}"
         })
         raise HTTPException(status_code=500, detail=str(e))
 
+    return JSONResponse(content=submit_job(
+        session_id, "恢复失败", run_scan_images, session_id, request, paths, cleanup=release_artifacts(held)))
 
-@app.post("/scan-video")
-async def scan_video(request: VideoScanRequest):
-    session_id = str(uuid.uuid4())
-    sessions[session_id] = {
-        "status": "processing",
-        "progress": 0,
-        "message": "开始扫描视频...",
-        "restored_file": None
-    }
 
-    try:
-        # 保存视频到临时文件
-        video_data = base64.b64decode(request.video.split(",")[1])
-        video_path = os.path.join(OUTPUT_DIR, f"{session_id}_video.mp4")
-        with open(video_path, "wb") as f:
-            f.write(video_data)
+@app.post("/scan-images-upload")
+async def scan_images_upload(
+        files: List[UploadFile] = File(...),
+        session_id: Optional[str] = Form(None),
+        base_file: Optional[UploadFile] = File(None),
+        ladder: Optional[str] = Form(None),
+        decoder: str = Form("pyzbar"),
+        draft: bool = Form(True),
+        max_chunk_size: int = Form(1800),
+        grid: bool = Form(False)
+):
+    """/scan-images 的 multipart 版本 - 图片写入制品存储后按路径交给解码进程"""
+    ladder = [stage.strip() for stage in ladder.split(",") if stage.strip()] if ladder else None
+    validate_scan_options(ladder, decoder)
 
-        # 扫描视频
-        unique_qrs = OrderedDict()
+    session_id = open_scan_session(session_id, "开始扫描二维码...")
+    held = []
 
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            raise ValueError("无法打开视频文件")
+    try:
+        if base_file:
+            save_scan_base_artifact(session_id, await artifacts.put_upload(base_file))
 
-        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        scanned_frames = 0
-        unique_count = 0
+        for upload in files:
+            held.append(await artifacts.put_upload(upload))
 
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
+    except Exception as e:
+        release_artifacts(held)()
+        sessions[session_id].update({
+            "status": "error",
+            "message": f"恢复失败: {str(e)}"
+        })
+        raise HTTPException(status_code=500, detail=str(e))
+
+    request = ScanRequest(
+        session_id=session_id,
+        ladder=ladder,
+        decoder=decoder,
+        draft=draft,
+        max_chunk_size=max_chunk_size,
+        grid=grid
+    )
+    # 解码完成后释放上传的图片
+    paths = [artifacts.path(artifact_id) for artifact_id in held]
+    return JSONResponse(content=submit_job(
+        session_id, "恢复失败", run_scan_images, session_id, request, paths, cleanup=release_artifacts(held)))
+
+
+def scan_video_segments(session_id, video_path, decoder_name, frame_count, count, stop_when_complete=True,
+                        expect_transfers=None):
+    """把视频按时间切成 count 段在解码进程中并行扫描，各段完成时合并分块
+
+    分块齐全后不再等待其余分段: 尚未开始的分段取消，正在扫描的分段通过停止标记文件结束
+    （解码进程池与 /scan-images 共用），返回 (新增分块数, 帧统计)
+    """
+    assembler = sessions[session_id]["assembler"]
+    pool = get_decode_pool()
+    stop_path = os.path.join(OUTPUT_DIR, f"segments_{uuid.uuid4().hex}.stop")
+    futures = {pool.submit(scan_video_segment, video_path, start, end, decoder_name, stop_path,
+                           stop_when_complete, expect_transfers): end - start
+               for start, end in video_segments(frame_count, count)}
+    started_at = time.time()
+
+    new_chunks = 0
+    done = 0
+    totals = Counter()
+
+    def merge(values, stats):
+        nonlocal new_chunks
+        for qr_data in values:
+            if assembler.add(qr_data):
+                new_chunks += 1
+        for name in VIDEO_SEGMENT_COUNTERS:
+            totals[name] += stats[name]
+
+    merged = set()
+    try:
+        for future in as_completed(futures):
+            merge(*future.result())
+            merged.add(future)
+            done += 1
+
+            update_session(
+                session_id,
+                progress=int(done / len(futures) * 100),
+                message=f"分段扫描中... 已完成 {done}/{len(futures)} 段，已收集 {assembler.received} 个分块"
+            )
+            if stop_when_complete and assembler.finished(expect_transfers):
                 break
+    finally:
+        if done < len(futures):
+            for future in futures:
+                future.cancel()
+            with open(stop_path, "wb"):
+                pass
+            # 等待正在扫描的分段看到停止标记后结束
+            for future in futures:
+                if not future.cancelled():
+                    future.exception()
+            os.remove(stop_path)
+
+    # 被停止的分段已读取部分的分块和帧数也计入结果
+    for future in futures:
+        if future not in merged and not future.cancelled() and future.exception() is None:
+            merge(*future.result())
+
+    stopped_early = done < len(futures)
+    remaining = max(sum(futures.values()) - totals["frames_read"], 0) if stopped_early else 0
+    saved_seconds = None
+    if remaining and totals["frames_read"]:
+        saved_seconds = round((time.time() - started_at) / totals["frames_read"] * remaining, 1)
+    return new_chunks, {
+        **{name: totals[name] for name in VIDEO_SEGMENT_COUNTERS},
+        "segments": len(futures),
+        "segments_scanned": done,
+        "stopped_early": stopped_early,
+        "frames_remaining": remaining,
+        "saved_seconds": saved_seconds
+    }
 
-            scanned_frames += 1
-            progress = min(100, int((scanned_frames / frame_count) * 100))
 
-            # 更新进度
-            sessions[session_id]["progress"] = progress
-            sessions[session_id]["message"] = f"扫描中... ({scanned_frames}/{frame_count} 帧)"
-            await asyncio.sleep(0.01)  # 让出控制权
-
-            # 解码二维码
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            pil_image = Image.fromarray(frame_rgb)
-            decoded_objects = pyzbar.decode(pil_image)
-
-            if decoded_objects:
-                for obj in decoded_objects:
-                    if obj.type == 'QRCODE':
-                        qr_data = obj.data.decode('utf-8')
-                        if qr_data not in unique_qrs:
-                            unique_qrs[qr_data] = True
-                            unique_count += 1
-                            sessions[session_id]["message"] = f"发现新二维码: #{unique_count}"
+def run_scan_video(session_id, video_path, decoder_name, upload=None, segments=None, stop_when_complete=True,
+                   expect_transfers=None):
+    """流水线扫描已保存到磁盘的视频并汇总分块（后台任务），结果写入会话
 
-        cap.release()
+    给出 upload（尚在进行的断点续传上传）时，只读取从开头起连续到达的数据，边上传边扫描；
+    完整的长视频按时间分成 segments 段（默认按CPU核数和视频长度自动选择）在多个进程中并行扫描；
+    stop_when_complete 为 False 时读完整个视频，给出 expect_transfers 时这么多个传输都齐全才提前结束
+    """
+    assembler = sessions[session_id]["assembler"]
 
-        if not unique_qrs:
+    if upload:
+        # 先等待开头一段数据（包含视频头）；上传完成后文件移入制品存储，路径以 upload.path 为准
+        wait_for_upload(upload, UPLOAD_READ_AHEAD)
+        video_path = upload.path
+
+    # 扫描视频
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened() and upload:
+        # 索引在文件末尾等无法流式读取的格式（或文件刚移入制品存储）: 等上传完成后再打开
+        wait_for_upload(upload, upload.size)
+        video_path = upload.path
+        cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError("无法打开视频文件")
+
+    # 分段数: 上传尚未完成时只能顺序读取
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    if upload and not upload.completed or frame_count <= 0:
+        segments = 1
+    elif not segments:
+        segments = min(DECODE_WORKERS, frame_count // VIDEO_SEGMENT_MIN_FRAMES)
+    if segments > 1:
+        cap.release()
+        if upload:
+            video_path = upload.path
+        new_chunks, stats = scan_video_segments(session_id, video_path, decoder_name, frame_count, segments,
+                                                stop_when_complete, expect_transfers)
+        if assembler.empty:
             raise ValueError("未在视频中发现二维码")
+        if stats["stopped_early"]:
+            saved = f"，约节省 {stats['saved_seconds']} 秒" if stats["saved_seconds"] else ""
+            update_session(
+                session_id,
+                message=f"分块已齐全，提前结束扫描（已完成 {stats['segments_scanned']}/{stats['segments']} 段{saved}），开始恢复..."
+            )
+        finish_scan_round(session_id, new_chunks, **stats)
+        return
+
+    def wait_for_frames(frames_read):
+        # 按已读帧数估算读取位置，超出已连续到达的数据时等待上传
+        if not upload.completed:
+            total = scanner.frame_count
+            position = (frames_read + 1) / total * upload.size if total > 0 else upload.size
+            wait_for_upload(upload, position + UPLOAD_READ_AHEAD)
+
+    def report(scanner):
+        total = max(scanner.frame_count, 1)
+        update_session(
+            session_id,
+            progress=min(100, int(scanner.frames_read / total * 100)),
+            message=f"扫描中... ({scanner.frames_read}/{scanner.frame_count} 帧)，已收集 {assembler.received} 个分块"
+        )
 
-        # 合并数据
-        sessions[session_id]["message"] = "合并数据..."
-        processor = QRProcessor(OUTPUT_DIR)
-        combined = processor.combine_data(list(unique_qrs.keys()))
+    # 采集线程读帧，解码线程并行解码
+    scanner = VideoScanner(decoder_name, assembler=assembler, progress_callback=report,
+                           stop_when_complete=stop_when_complete, expect_transfers=expect_transfers)
+    try:
+        new_chunks = scanner.run(cap, wait_for_frames if upload else None)
+    finally:
+        cap.release()
 
-        if not combined:
-            raise ValueError("数据不完整")
+    if assembler.empty:
+        raise ValueError("未在视频中发现二维码")
 
-        # 恢复文件
-        sessions[session_id]["message"] = "恢复文件..."
-        output_path = processor.restore(combined)
+    if scanner.stopped_early:
+        saved = f"，约节省 {scanner.saved_seconds} 秒" if scanner.saved_seconds else ""
+        update_session(
+            session_id,
+            message=f"分块已齐全，提前结束扫描（第 {scanner.frames_read}/{scanner.frame_count} 帧{saved}），开始恢复..."
+        )
 
-        # 读取恢复的文件
-        with open(output_path, "rb") as f:
-            file_content = f.read()
+    finish_scan_round(session_id, new_chunks, **scanner.stats())
 
+
+@app.post("/scan-video")
+async def scan_video(request: VideoScanRequest):
+    validate_scan_options(None, request.decoder)
+    validate_segments(request.segments)
+    validate_expect_transfers(request.expect_transfers)
+    if not (request.video or request.upload_id or request.artifact_id):
+        raise HTTPException(status_code=400, detail="未提供视频数据")
+    upload = get_upload(request.upload_id) if request.upload_id else None
+    base_upload = get_upload(request.base_upload_id, completed=True) if request.base_upload_id else None
+
+    # 取得的引用在交给会话之前出错时释放
+    video_artifact = base_artifact = None
+    try:
+        if request.artifact_id and not upload:
+            video_artifact = acquire_artifact(request.artifact_id)
+        if request.base_artifact_id:
+            base_artifact = acquire_artifact(request.base_artifact_id)
+        session_id = open_scan_session(request.session_id, "开始扫描视频...")
+    except HTTPException:
+        release_artifacts([artifact_id for artifact_id in (video_artifact, base_artifact) if artifact_id])()
+        raise
+
+    try:
+        if base_artifact:
+            save_scan_base_artifact(session_id, base_artifact)
+            base_artifact = None
+        elif base_upload:
+            save_scan_base_artifact(session_id, base_upload.acquire())
+        else:
+            save_scan_base_file(session_id, request.base_file)
+
+        if upload and upload.completed:
+            # 已完成的上传: 会话持有制品引用，与普通视频相同
+            video_artifact = upload.acquire()
+            upload = None
+
+        if upload:
+            # 断点续传上传: 可在上传完成前开始扫描
+            video_path = upload.path
+        else:
+            # 视频存入制品存储（重复上传同一视频只保存一份）
+            if not video_artifact:
+                video_artifact = artifacts.put_data_url(request.video)
+            video_path = artifacts.path(video_artifact)
+            hold_artifact(sessions[session_id], "video_artifact", video_artifact)
+            video_artifact = None
+
+    except Exception as e:
+        release_artifacts([artifact_id for artifact_id in (video_artifact, base_artifact) if artifact_id])()
         sessions[session_id].update({
-            "status": "completed",
-            "progress": 100,
-            "message": "恢复完成",
-            "restored_file": base64.b64encode(file_content).decode(),
-            "file_name": os.path.basename(output_path)
+            "status": "error",
+            "message": f"视频恢复失败: {str(e)}"
         })
+        raise HTTPException(status_code=500, detail=str(e))
 
-        return JSONResponse(content={
-            "file_name": os.path.basename(output_path),
-            "message": "文件恢复成功"
+    return JSONResponse(content=submit_job(
+        session_id, "视频恢复失败", run_scan_video, session_id, video_path, request.decoder, upload,
+        request.segments, request.stop_when_complete, request.expect_transfers))
+
+
+def run_scan_stream(session_id, source, decoder_name, idle_timeout, max_duration=STREAM_MAX_DURATION):
+    """持续扫描实时视频源（在实时扫描线程池中执行）: 新分块作为事件写入会话，
+    分块齐全、停止、长时间无新帧或达到最长持续时间时结束
+    """
+    session = sessions[session_id]
+    assembler = session["assembler"]
+    events = session.setdefault("events", [])
+    started_at = time.time()
+
+    def on_chunk(qr_data):
+        header = ChunkAssembler.parse_header(qr_data) if qr_data.startswith("QR:") else None
+        events.append({
+            "transfer_id": ChunkAssembler.transfer_key(qr_data) if header else None,
+            "chunk": header[0] if header else None,
+            "total": assembler.total,
+            "received": assembler.received,
+            "elapsed": round(time.time() - started_at, 2)
         })
 
+    def report(scanner):
+        total = f"/{assembler.total}" if assembler.total else ""
+        update_session(
+            session_id,
+            progress=int(assembler.received / assembler.total * 100) if assembler.total else 0,
+            message=f"实时扫描中... 已读取 {scanner.frames_read} 帧，已收集 {assembler.received}{total} 个分块"
+        )
+
+    scanner = VideoScanner(decoder_name, assembler=assembler, progress_callback=report, chunk_callback=on_chunk,
+                           settle_frames=STREAM_SETTLE_FRAMES)
+    capture = StreamCapture(source, idle_timeout, scanner.stop_event, max_duration)
+    session["stream_scanner"] = scanner
+    try:
+        new_chunks = scanner.run(capture)
+    finally:
+        capture.release()
+        session.pop("stream_scanner", None)
+
+    if assembler.empty:
+        raise ValueError("未在视频流中发现二维码")
+
+    finish_scan_round(session_id, new_chunks, timed_out=capture.timed_out, **scanner.stats())
+
+
+@app.post("/scan-stream")
+async def scan_stream(request: StreamScanRequest):
+    """实时扫描: 边接收视频边解码，新分块事件通过 /session/{session_id}?since=N 获取"""
+    validate_scan_options(None, request.decoder)
+    if not request.source:
+        raise HTTPException(status_code=400, detail="未提供视频源")
+    if not 0 < request.idle_timeout <= STREAM_MAX_IDLE_TIMEOUT:
+        raise HTTPException(status_code=400, detail=f"空闲超时应在 0 到 {STREAM_MAX_IDLE_TIMEOUT} 秒之间")
+    if not 0 < request.max_duration <= STREAM_DURATION_LIMIT:
+        raise HTTPException(status_code=400, detail=f"最长扫描时间应在 0 到 {STREAM_DURATION_LIMIT} 秒之间")
+
+    # 占用一个实时扫描名额，任务结束时释放
+    if not stream_slots.acquire(blocking=False):
+        raise HTTPException(status_code=429, detail=f"同时进行的实时扫描已达上限 ({STREAM_WORKERS} 个)")
+    base_artifact = None
+    try:
+        base_upload = get_upload(request.base_upload_id, completed=True) if request.base_upload_id else None
+        base_artifact = acquire_artifact(request.base_artifact_id) if request.base_artifact_id else None
+        session_id = open_scan_session(request.session_id, "开始实时扫描...")
+    except Exception:
+        stream_slots.release()
+        if base_artifact:
+            artifacts.release(base_artifact)
+        raise
+
+    try:
+        if base_artifact:
+            save_scan_base_artifact(session_id, base_artifact)
+        elif base_upload:
+            save_scan_base_artifact(session_id, base_upload.acquire())
+        else:
+            save_scan_base_file(session_id, request.base_file)
+
+    except Exception as e:
+        stream_slots.release()
+        sessions[session_id].update({
+            "status": "error",
+            "message": f"实时扫描失败: {str(e)}"
+        })
+        raise HTTPException(status_code=500, detail=str(e))
+
+    return JSONResponse(content=submit_job(
+        session_id, "实时扫描失败", run_scan_stream, session_id, request.source, request.decoder,
+        request.idle_timeout, request.max_duration, cleanup=stream_slots.release, pool=get_stream_pool()))
+
+
+@app.post("/scan-stream/{session_id}/stop")
+async def stop_scan_stream(session_id: str):
+    """停止实时扫描，已收集的分块按普通扫描轮次处理"""
+    session = sessions.get(session_id)
+    if not session:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    scanner = session.get("stream_scanner")
+    if not scanner:
+        raise HTTPException(status_code=409, detail="没有正在进行的实时扫描")
+    scanner.stop()
+    return JSONResponse(content={"session_id": session_id, "message": "已停止实时扫描"})
+
+
+@app.post("/scan-video-upload")
+async def scan_video_upload(
+        video: UploadFile = File(...),
+        session_id: Optional[str] = Form(None),
+        base_file: Optional[UploadFile] = File(None),
+        decoder: str = Form("pyzbar"),
+        segments: Optional[int] = Form(None),
+        stop_when_complete: bool = Form(True),
+        expect_transfers: Optional[int] = Form(None)
+):
+    """/scan-video 的 multipart 版本 - 视频直接分块写入制品存储，不经过 base64"""
+    validate_scan_options(None, decoder)
+    validate_segments(segments)
+    validate_expect_transfers(expect_transfers)
+
+    session_id = open_scan_session(session_id, "开始扫描视频...")
+
+    try:
+        if base_file:
+            save_scan_base_artifact(session_id, await artifacts.put_upload(base_file))
+
+        hold_artifact(sessions[session_id], "video_artifact", await artifacts.put_upload(video))
+        video_path = artifacts.path(sessions[session_id]["video_artifact"])
+
     except Exception as e:
         sessions[session_id].update({
             "status": "error",
@@ -922,20 +3928,43 @@ async def scan_video(request: VideoScanRequest):
         })
         raise HTTPException(status_code=500, detail=str(e))
 
+    return JSONResponse(content=submit_job(
+        session_id, "视频恢复失败", run_scan_video, session_id, video_path, decoder, None, segments,
+        stop_when_complete, expect_transfers))
+
+
+@app.get("/decode-stats")
+async def get_decode_stats():
+    """各解码后端/预处理阶段的成功次数和平均耗时，用于选择后端和调整默认阶梯"""
+    decoders = {}
+    for name, images in DECODE_IMAGE_STATS.items():
+        decoders[name] = {
+            "images": images,
+            "failed": DECODE_STAGE_STATS[f"{name}/failed"],
+            "avg_ms": round(DECODE_TIME_STATS[name] / images * 1000, 1)
+        }
+
+    return JSONResponse(content={
+        "ladder": DECODE_LADDER,
+        "stages": dict(DECODE_STAGE_STATS),
+        "decoders": decoders
+    })
+
 
 @app.get("/download/{session_id}")
-async def download_files(session_id: str, file_type: str):
+async def download_files(session_id: str, file_type: str, transfer_id: Optional[str] = None):
     session = sessions.get(session_id)
     if not session:
         raise HTTPException(status_code=404, detail="会话不存在")
 
     try:
-        if file_type == "qr" and session.get("qr_images"):
+        qr_key = {"qr": "qr_images", "resend": "resend_images"}.get(file_type)
+        if qr_key and session.get(qr_key):
             # 创建ZIP文件
             zip_buffer = io.BytesIO()
             with zipfile.ZipFile(zip_buffer, "w") as zipf:
-                for qr in session["qr_images"]:
-                    zipf.write(qr["path"], os.path.basename(qr["path"]))
+                for qr in session[qr_key]:
+                    zipf.write(artifacts.path(qr["artifact_id"]), qr["file_name"])
 
             zip_buffer.seek(0)
             return StreamingResponse(
@@ -944,17 +3973,28 @@ async def download_files(session_id: str, file_type: str):
                 headers={"Content-Disposition": f"attachment; filename=qr_codes_{session_id}.zip"}
             )
 
-        elif file_type == "restored" and session.get("restored_file"):
-            file_content = base64.b64decode(session["restored_file"])
-            return StreamingResponse(
-                io.BytesIO(file_content),
+        elif file_type == "restored" and transfer_id:
+            restored = session.get("restored_transfers", {}).get(transfer_id)
+            if not restored:
+                raise HTTPException(status_code=404, detail="该传输没有恢复的文件")
+            return FileResponse(
+                artifacts.path(restored["artifact_id"]),
+                media_type="application/octet-stream",
+                filename=restored["file_name"]
+            )
+
+        elif file_type == "restored" and session.get("restored_artifact"):
+            return FileResponse(
+                artifacts.path(session["restored_artifact"]),
                 media_type="application/octet-stream",
-                headers={"Content-Disposition": f"attachment; filename={session['file_name']}"}
+                filename=session["file_name"]
             )
 
         else:
             raise HTTPException(status_code=404, detail="文件不存在")
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -4,42 +4,87 @@ import pickle
 import zlib
 import qrcode
 import tkinter as tk
-from tkinter import filedialog, messagebox, ttk, scrolledtext
+from tkinter import filedialog, messagebox, ttk, scrolledtext, simpledialog
 from openpyxl import load_workbook, Workbook
 from openpyxl.styles import Font, PatternFill, Border, Alignment
 from PIL import Image, ImageTk, ImageDraw, ImageFont
 import threading
+import queue
 import logging
 import pyzbar.pyzbar as pyzbar
 import base64
+import hashlib
 import re
 from datetime import datetime
 import struct
 import time
 import cv2  # 用于视频处理
+import numpy as np
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+
+# 图片解码进程池（首次使用时创建）
+DECODE_WORKERS = os.cpu_count() or 1
+_decode_pool = None
+
+
+def get_decode_pool():
+    """获取图片解码进程池"""
+    global _decode_pool
+    if _decode_pool is None:
+        _decode_pool = ProcessPoolExecutor(max_workers=DECODE_WORKERS)
+    return _decode_pool
+
+
+def decode_image_source(source):
+    """解码单张图片中的二维码 - 在解码进程中执行"""
+    img = Image.open(source)
+    results = pyzbar.decode(img)
+    return [r.data.decode('utf-8') for r in results if r.type == 'QRCODE']
 
 
 class VideoQRScanner:
-    """视频二维码扫描器"""
+    """视频二维码扫描器 - 读帧线程把帧放入有界队列，单个工作线程循环解码，只保存二维码内容"""
 
-    def __init__(self, video_path, output_dir, callback):
+    def __init__(self, video_path, output_dir, callback, keep_thumbnails=False):
         self.video_path = video_path
         self.output_dir = output_dir
         self.callback = callback
         self.cap = None
-        self.running = False
-        self.unique_qrs = OrderedDict()  # 使用有序字典存储唯一二维码
-        self.current_frame = None
+        self.running = False  # 扫描进行中（工作线程结束时变为 False）
+        self.stop_event = threading.Event()
+        self.frames = queue.Queue(maxsize=16)  # 读帧线程和工作线程之间的有界帧队列
+        # 复用帧缓冲区（解码完的帧交还给读帧线程）和灰度缓冲区，避免逐帧分配
+        self.free_frames = queue.SimpleQueue()
+        self.gray = None
+        # 二维码内容 -> 二维码区域缩略图（keep_thumbnails 为 False 时为 None，不保存整帧）
+        self.unique_qrs = OrderedDict()
+        self.keep_thumbnails = keep_thumbnails
+        self.thumbnail_size = 128
         self.frame_count = 0
         self.scanned_frames = 0
         self.unique_count = 0
         self.last_qr_data = None
-        self.scan_interval = 0.01  # 帧处理间隔（秒）
+        # 进度回调合并: 两次回调的最小间隔（秒）
+        self.progress_interval = 0.2
+        self.last_progress_time = 0
+        # 帧变化检测: 跳过与上一次解码帧几乎相同的帧，漏检后逐帧解码一段
+        self.pixel_threshold = 16  # 缩略图像素灰度差超过多少算变化
+        self.diff_threshold = 4  # 变化像素达到多少判定为画面变化（二维码只占画面一小部分时也能发现）
+        self.dense_span = 8  # 漏检后逐帧解码的帧数
+        self.last_thumb = None
+        self.dense_until = 0
+        self.skipped_frames = 0
+        # 按分块头中的总数判断分块齐全后提前结束（视频常循环播放多遍）；按传输标识分组，多个文件的分块不混在一起
+        self.transfers = OrderedDict()  # 传输标识 -> {分块编号: 二维码内容}
+        self.totals = {}  # 传输标识 -> 分块总数
+        self.start_time = None
+        self.stopped_early = False
         self.min_confidence = 30  # 最小置信度阈值
 
     def start(self):
-        """开始扫描视频"""
+        """开始扫描视频（后台线程），扫描结束时 running 变为 False"""
         try:
             self.cap = cv2.VideoCapture(self.video_path)
             if not self.cap.isOpened():
@@ -47,55 +92,160 @@ class VideoQRScanner:
 
             self.running = True
             self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.start_time = time.time()
             self.callback(0, f"开始扫描视频: {os.path.basename(self.video_path)}")
-            self.process_video()
+            threading.Thread(target=self.read_frames, daemon=True).start()
+            threading.Thread(target=self.process_video, daemon=True).start()
         except Exception as e:
             self.callback(0, f"视频扫描错误: {str(e)}")
-            self.stop()
+            if self.cap:
+                self.cap.release()
+            self.running = False
 
-    def process_video(self):
-        """处理视频帧"""
-        if not self.running or not self.cap.isOpened():
-            return
+    def read_frames(self):
+        """读帧线程: 按顺序读取帧，跳过与上一次解码帧几乎相同的帧，其余放入有界队列"""
+        try:
+            while not self.stop_event.is_set():
+                try:
+                    buffer = self.free_frames.get_nowait()
+                except queue.Empty:
+                    buffer = None
+                ret, frame = self.cap.read(buffer)
+                if not ret:
+                    break
+                self.scanned_frames += 1
+                self.report_progress()
+
+                # 画面与上一次解码帧几乎相同时不再解码（比较缩小后的灰度图）
+                thumb = cv2.cvtColor(cv2.resize(frame, (32, 32), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+                if (self.last_thumb is not None and self.scanned_frames > self.dense_until
+                        and (cv2.absdiff(thumb, self.last_thumb) > self.pixel_threshold).sum() < self.diff_threshold):
+                    self.skipped_frames += 1
+                    self.free_frames.put(frame)
+                    continue
+                self.last_thumb = thumb
+
+                # 队列满时等待工作线程
+                while not self.stop_event.is_set():
+                    try:
+                        self.frames.put((self.scanned_frames, frame), timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+        except Exception as e:
+            logging.warning(f"读取视频帧失败: {str(e)}")
+        finally:
+            self.cap.release()
+            # 通知工作线程结束（工作线程会一直取到结束标记，不会阻塞）
+            self.frames.put(None)
 
-        ret, frame = self.cap.read()
-        if not ret:
-            self.stop()
-            self.callback(100, "视频处理完成")
+    def report_progress(self):
+        """合并进度回调: 距上一次回调不足 progress_interval 秒时不回调"""
+        now = time.time()
+        if now - self.last_progress_time < self.progress_interval:
             return
+        self.last_progress_time = now
+        progress = min(100, int(self.scanned_frames / max(self.frame_count, 1) * 100))
+        self.callback(progress, f"扫描中... ({self.scanned_frames}/{self.frame_count} 帧)，"
+                                f"已发现 {self.unique_count} 个二维码")
 
-        self.scanned_frames += 1
-        progress = min(100, int((self.scanned_frames / self.frame_count) * 100))
-        self.callback(progress, f"扫描中... ({self.scanned_frames}/{self.frame_count} 帧)")
-
-        # 转换为PIL图像进行处理
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        pil_image = Image.fromarray(frame_rgb)
-        self.current_frame = pil_image
-
-        # 解码二维码
-        decoded_objects = pyzbar.decode(pil_image)
-
-        if decoded_objects:
-            for obj in decoded_objects:
-                if obj.type == 'QRCODE':
-                    qr_data = obj.data.decode('utf-8')
-
-                    # 检查是否是新二维码
-                    if qr_data not in self.unique_qrs:
-                        self.unique_qrs[qr_data] = pil_image
-                        self.unique_count += 1
-                        self.last_qr_data = qr_data
-                        self.callback(progress, f"发现新二维码: #{self.unique_count}")
+    def process_video(self):
+        """工作线程: 循环从队列取帧解码"""
+        try:
+            while True:
+                item = self.frames.get()
+                if item is None:
+                    break
+                if self.stop_event.is_set():
+                    continue
+
+                index, frame = item
+                try:
+                    self.decode_frame(index, frame)
+                except Exception as e:
+                    logging.warning(f"第 {index} 帧解码失败: {str(e)}")
+                self.free_frames.put(frame)
 
-        # 继续处理下一帧
-        threading.Timer(self.scan_interval, self.process_video).start()
+                if self.complete:
+                    self.finish_early()
+        finally:
+            if not self.stopped_early:
+                self.callback(100, "视频处理完成")
+            self.running = False
+
+    def decode_frame(self, index, frame):
+        """解码一帧，新二维码只保存内容（和可选的缩略图）"""
+        # 转为灰度写入复用的缓冲区，pyzbar 直接读取 ndarray，不再经过 RGB 和 PIL 图像
+        if self.gray is None or self.gray.shape != frame.shape[:2]:
+            self.gray = np.empty(frame.shape[:2], dtype=np.uint8)
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self.gray)
+
+        found = False
+        for obj in pyzbar.decode(gray):
+            if obj.type != 'QRCODE':
+                continue
+            found = True
+            qr_data = obj.data.decode('utf-8')
+
+            # 检查是否是新二维码
+            if qr_data not in self.unique_qrs:
+                self.unique_qrs[qr_data] = self.thumbnail(gray, obj.rect) if self.keep_thumbnails else None
+                self.unique_count += 1
+                self.last_qr_data = qr_data
+                self.track_chunk(qr_data)
+
+        if not found and index > self.dense_until:
+            # 画面变化后未识别到二维码（切换中的模糊帧等）: 之后一段帧逐帧解码
+            self.dense_until = index + self.dense_span
+
+    def thumbnail(self, image, rect):
+        """二维码区域的缩略图（从灰度帧复制出区域）"""
+        thumb = Image.fromarray(image[rect.top:rect.top + rect.height, rect.left:rect.left + rect.width])
+        thumb.thumbnail((self.thumbnail_size, self.thumbnail_size))
+        return thumb
+
+    @staticmethod
+    def transfer_key(qr_data):
+        """分块所属传输的标识: 分块头中的传输标识，没有时由 分块总数-模式-版本 推断"""
+        header, version, mode, _ = qr_data.split('|', 3)
+        version, _, transfer_id = version.partition('#')
+        return transfer_id or f"{header.split('/')[1]}-{mode}-{version}"
+
+    def track_chunk(self, qr_data):
+        """按传输记录分块头 "QR:序号/总数|v8#传输标识|..." 中的序号和总数"""
+        if not qr_data.startswith("QR:") or qr_data.count('|') < 3:
+            return
+        try:
+            chunk_num, total = (int(x) for x in qr_data.split('|', 1)[0][3:].split('/'))
+        except ValueError:
+            return
+        if 1 <= chunk_num <= total:
+            key = self.transfer_key(qr_data)
+            self.transfers.setdefault(key, {})[chunk_num] = qr_data
+            self.totals[key] = total
+
+    @property
+    def complete(self):
+        """已出现的分块传输都已齐全"""
+        return bool(self.transfers) and all(len(chunks) >= self.totals[key] for key, chunks in self.transfers.items())
+
+    def transfer_results(self):
+        """按传输分组的二维码内容；没有分块头的二维码各自一组"""
+        groups = [list(chunks.values()) for chunks in self.transfers.values()]
+        groups += [[qr_data] for qr_data in self.unique_qrs if not qr_data.startswith("QR:")]
+        return groups
+
+    def finish_early(self):
+        """分块已齐全: 不再读取剩余帧，按当前速度估算节省的时间"""
+        remaining = max(self.frame_count - self.scanned_frames, 0)
+        saved = (time.time() - self.start_time) / max(self.scanned_frames, 1) * remaining
+        self.stopped_early = True
+        self.stop()
+        self.callback(100, f"分块已齐全，提前结束扫描（跳过 {remaining} 帧，约节省 {saved:.1f} 秒）")
 
     def stop(self):
-        """停止扫描"""
-        self.running = False
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
+        """停止扫描（读帧线程退出时释放视频）"""
+        self.stop_event.set()
 
     def get_results(self):
         """获取扫描结果"""
@@ -153,6 +303,7 @@ class FileQRApp:
         self.last_region = "A1:D10"  # 默认区域
         self.last_sheet = ""  # 默认Sheet
         self.video_scanner = None  # 视频扫描器实例
+        self.qr_chunk_size = None  # 上次完整生成时使用的数据块大小
 
     def create_ui(self):
         """创建用户界面"""
@@ -255,6 +406,7 @@ class FileQRApp:
 
         ttk.Button(btn_frame, text="序列化", command=self.serialize).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(btn_frame, text="生成二维码", command=self.generate_qr).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
+        ttk.Button(btn_frame, text="补发分块", command=self.regenerate_qr).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(btn_frame, text="图片恢复", command=self.scan_restore).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(btn_frame, text="视频恢复", command=self.scan_video).pack(side=tk.LEFT, padx=5, fill=tk.X, expand=True)
         ttk.Button(btn_frame, text="保存二维码", command=self.save_qr_images).pack(side=tk.LEFT, padx=5, fill=tk.X,
@@ -346,19 +498,21 @@ class FileQRApp:
                     self.log(f"在视频中发现 {len(qr_data)} 个唯一二维码")
                     self.update_progress(70, "合并数据...")
 
-                    # 合并数据
-                    combined = self.combine_data(list(qr_data.keys()))
-                    if not combined:
-                        raise ValueError("数据不完整")
-
-                    # 恢复数据
-                    self.update_progress(80, "恢复文件...")
+                    # 按传输分别合并恢复（视频中可能有多个文件的二维码序列）
                     processor = QRProcessor(self.output_dir)
-                    output_path = processor.restore(combined)
+                    output_paths = []
+                    for chunks in self.video_scanner.transfer_results():
+                        combined = self.combine_data(chunks)
+                        if not combined:
+                            continue
+                        self.update_progress(80, "恢复文件...")
+                        output_paths.append(processor.restore(combined))
+                        self.log(f"文件已恢复至: {output_paths[-1]}")
+                    if not output_paths:
+                        raise ValueError("数据不完整")
 
-                    self.log(f"文件已恢复至: {output_path}")
                     self.update_progress(100, "恢复完成！")
-                    messagebox.showinfo("成功", f"文件已恢复至:\n{output_path}")
+                    messagebox.showinfo("成功", "文件已恢复至:\n" + "\n".join(output_paths))
             except Exception as e:
                 self.log(f"视频恢复失败: {str(e)}")
                 self.update_progress(0, f"视频恢复失败: {str(e)}")
@@ -471,6 +625,7 @@ class FileQRApp:
 
         # 重置数据
         self.serialized_data = None
+        self.qr_chunk_size = None
         self.qr_images = []
         self.current_qr_index = 0
         self.show_qr()
@@ -532,6 +687,7 @@ class FileQRApp:
                 time.sleep(0.1)  # 让UI更新
                 processor = QRProcessor(self.output_dir)
                 file_path = self.file_path.get()
+                self.qr_chunk_size = None  # 新数据需要重新完整生成
 
                 if self.mode == "region":
                     region = self.region_entry.get()
@@ -590,6 +746,8 @@ class FileQRApp:
                     progress_callback=self.update_progress
                 )
 
+                self.qr_chunk_size = chunk_size
+
                 # 显示第一个二维码
                 self.current_qr_index = 0
                 self.update_navigation()
@@ -608,6 +766,48 @@ class FileQRApp:
 
         threading.Thread(target=task, daemon=True).start()
 
+    def regenerate_qr(self):
+        """只重新生成指定分块（用于补发缺少的分块）"""
+        if not self.serialized_data:
+            messagebox.showwarning("警告", "请先序列化数据")
+            return
+
+        spec = simpledialog.askstring("补发分块", "输入需要补发的分块编号，例如: 3,17,40-42", parent=self.root)
+        if not spec:
+            return
+
+        def task():
+            try:
+                self.update_progress(0, "开始补发分块...")
+                processor = QRProcessor(self.output_dir)
+                # 沿用上次完整生成的分块大小，保证分块编号一致
+                chunk_size = self.qr_chunk_size or int(self.capacity_var.get())
+
+                self.qr_images = processor.create_qr_codes(
+                    self.serialized_data,
+                    max_size=chunk_size,
+                    version=self.version,
+                    mode=self.mode,
+                    progress_callback=self.update_progress,
+                    indices=spec
+                )
+
+                self.current_qr_index = 0
+                self.update_navigation()
+                self.show_qr()
+
+                self.log(f"已重新生成 {len(self.qr_images)} 个分块: {spec}")
+                self.update_progress(100, "补发分块生成完成！")
+            except Exception as e:
+                self.log(f"补发失败: {str(e)}")
+                self.update_progress(0, f"补发失败: {str(e)}")
+                messagebox.showerror("错误", f"补发失败: {str(e)}")
+                logging.exception("补发失败")
+            finally:
+                self.update_progress(0, "就绪")
+
+        threading.Thread(target=task, daemon=True).start()
+
     def scan_restore(self):
         """扫描二维码图片恢复数据"""
         files = filedialog.askopenfilenames(
@@ -624,15 +824,14 @@ class FileQRApp:
                 time.sleep(0.1)  # 让UI更新
                 processor = QRProcessor(self.output_dir)
 
-                # 解码二维码
+                # 解码二维码（多进程并行，按完成顺序汇总）
                 chunks = []
                 total_files = len(files)
-                for i, f in enumerate(files):
-                    self.update_progress(i / total_files * 50, f"扫描文件 {i + 1}/{total_files}")
-                    decoded = self.decode_qr(f)
-                    if decoded:
-                        chunks.extend(decoded)
-                    time.sleep(0.05)  # 避免UI卡顿
+                for done, (i, decoded, error) in enumerate(processor.decode_many(files), start=1):
+                    self.update_progress(done / total_files * 50, f"扫描文件 {done}/{total_files}")
+                    if error:
+                        self.log(f"解码失败 {files[i]}: {error}")
+                    chunks.extend(decoded)
 
                 if not chunks:
                     raise ValueError("未找到有效二维码数据")
@@ -690,16 +889,6 @@ class FileQRApp:
             self.update_progress(0, "就绪")
 
     # 辅助方法
-    def decode_qr(self, filepath):
-        """解码单个二维码"""
-        try:
-            img = Image.open(filepath)
-            results = pyzbar.decode(img)
-            return [r.data.decode('utf-8') for r in results if r.type == 'QRCODE']
-        except Exception as e:
-            self.log(f"解码失败 {filepath}: {str(e)}")
-            return []
-
     def combine_data(self, chunks):
         """合并分块数据"""
         try:
@@ -729,7 +918,7 @@ class FileQRApp:
                     # 解析版本
                     if version_part.startswith("v"):
                         try:
-                            version = int(version_part[1:])
+                            version = int(version_part[1:].split('#')[0])
                         except:
                             version = 0
 
@@ -749,9 +938,8 @@ class FileQRApp:
                 missing = [i for i in range(1, total_chunks + 1) if i not in chunks_dict]
                 raise ValueError(f"数据不完整: 缺少分块 {missing}")
 
-            # 按顺序组合分块
-            combined_b64 = ''.join(chunks_dict[i] for i in sorted(chunks_dict.keys()))
-            return base64.b64decode(combined_b64)
+            # 按顺序组合分块（逐块解码，分块长度不是3的倍数时base64带填充）
+            return b''.join(base64.b64decode(chunks_dict[i]) for i in sorted(chunks_dict.keys()))
 
         except Exception as e:
             self.log(f"合并数据失败: {str(e)}")
@@ -1128,8 +1316,8 @@ class QRProcessor:
 
         return output_path
 
-    def create_qr_codes(self, data, max_size=1800, version=8, mode="file", progress_callback=None):
-        """生成二维码序列"""
+    def plan_qr_chunks(self, data, max_size=1800, version=8, mode="file"):
+        """计算二维码分块内容（不渲染），返回 [(名称, 内容, 标记文本), ...]"""
         # 计算base64编码后的最大原始数据大小
         max_raw_size = int(max_size * 0.7)  # 考虑base64开销
 
@@ -1137,41 +1325,88 @@ class QRProcessor:
         if len(data) <= max_raw_size:
             # 使用base64编码
             base64_data = base64.b64encode(data).decode('utf-8')
-            return [("single", self.create_single_qr(base64_data, f"{mode}"))]
+            return [("single", base64_data, f"{mode}")]
+
+        # 传输标识（由内容决定）: 扫描时据此区分同一段录像/同一批图片中的多个文件
+        transfer_id = hashlib.sha256(data).hexdigest()[:8]
 
-        # 计算需要多少分块
+        # 每块原始数据大小: 扣除分块头（按最长的编号计算）后，base64 编码结果不超过 max_size；
+        # 分块数会改变分块头的长度，重新计算直到分块数不再变化
         total_chunks = (len(data) + max_raw_size - 1) // max_raw_size
-        chunks = []
+        while True:
+            header_size = len(f"QR:{total_chunks}/{total_chunks}|v{version}#{transfer_id}|{mode}|")
+            raw_size = min(max_raw_size, (max_size - header_size) // 4 * 3)
+            if raw_size < 1:
+                raise ValueError(f"分块大小过小: {max_size}")
+            count = (len(data) + raw_size - 1) // raw_size
+            if count == total_chunks:
+                break
+            total_chunks = count
 
         # 大数据分块处理
+        plan = []
         for i in range(total_chunks):
-            start = i * max_raw_size
-            end = min(start + max_raw_size, len(data))
-            chunk_data = data[start:end]
+            chunk_data = data[i * raw_size:(i + 1) * raw_size]
 
             # 添加分块头并使用base64编码
-            header = f"QR:{i + 1}/{total_chunks}|v{version}|{mode}|"
+            header = f"QR:{i + 1}/{total_chunks}|v{version}#{transfer_id}|{mode}|"
             base64_chunk = base64.b64encode(chunk_data).decode('utf-8')
+            plan.append((f"chunk_{i + 1}_of_{total_chunks}", header + base64_chunk, f"{i + 1}/{total_chunks}"))
+
+        return plan
+
+    def create_qr_codes(self, data, max_size=1800, version=8, mode="file", progress_callback=None, indices=None):
+        """生成二维码序列 - indices 为需要渲染的分块编号（从1开始），None 表示全部"""
+        plan = self.plan_qr_chunks(data, max_size, version, mode)
 
-            # 检查总长度
-            full_chunk = header + base64_chunk
-            if len(full_chunk) > max_size:
-                # 如果超出，减小分块大小
-                new_max_raw_size = int(max_raw_size * 0.9)
-                return self.create_qr_codes(data, new_max_raw_size, version, mode, progress_callback)
+        if indices is not None:
+            if plan[0][0] == "single":
+                raise ValueError("数据只有单个二维码，无需指定分块")
+            plan = [plan[i - 1] for i in self.parse_chunk_indices(indices, len(plan))]
 
+        chunks = []
+        for i, (name, content, counter) in enumerate(plan):
             # 创建二维码
-            name = f"chunk_{i + 1}_of_{total_chunks}"
-            img = self.create_single_qr(full_chunk, f"{i + 1}/{total_chunks}")
-            chunks.append((name, img))
+            chunks.append((name, self.create_single_qr(content, counter)))
 
             # 更新进度
             if progress_callback:
-                progress = (i + 1) / total_chunks * 100
-                progress_callback(progress, f"生成二维码 {i + 1}/{total_chunks}")
+                progress = (i + 1) / len(plan) * 100
+                progress_callback(progress, f"生成二维码 {i + 1}/{len(plan)}")
 
         return chunks
 
+    def parse_chunk_indices(self, spec, total):
+        """解析分块编号 - 支持整数列表或 "3,17,40-42" 形式的范围"""
+        items = [spec] if isinstance(spec, str) else list(spec)
+
+        indices = set()
+        for item in items:
+            if isinstance(item, int):
+                indices.add(item)
+                continue
+            # 允许直接粘贴 "缺少分块 [3, 17, 42]" 中的列表
+            for part in re.split(r"[,，\s]+", str(item).strip().strip("[]")):
+                if not part:
+                    continue
+                try:
+                    if '-' in part:
+                        first, last = part.split('-', 1)
+                        indices.update(range(int(first), int(last) + 1))
+                    else:
+                        indices.add(int(part))
+                except ValueError:
+                    raise ValueError(f"无效的分块编号: {part}")
+
+        if not indices:
+            raise ValueError("未指定分块编号")
+
+        invalid = sorted(i for i in indices if i < 1 or i > total)
+        if invalid:
+            raise ValueError(f"分块编号超出范围 1-{total}: {invalid}")
+
+        return sorted(indices)
+
     def create_single_qr(self, data, counter=None):
         """创建单个二维码"""
         qr = qrcode.QRCode(
@@ -1216,6 +1451,16 @@ class QRProcessor:
 
         return img
 
+    def decode_many(self, sources):
+        """并行解码多张图片，按完成顺序返回 (序号, 二维码内容列表, 错误信息)"""
+        pool = get_decode_pool()
+        futures = {pool.submit(decode_image_source, source): i for i, source in enumerate(sources)}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], [], str(e)
+
     # 辅助方法
     def parse_region(self, region):
         """解析区域坐标 - 增强容错性"""
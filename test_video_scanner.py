@@ -0,0 +1,121 @@
+import os
+
+import numpy as np
+
+from main import QRProcessor, VideoScanner, STREAM_SETTLE_FRAMES, VIDEO_QUEUE_SIZE
+
+
+class LinearSource:
+    """不循环的视频源: 依次显示各分块，之后一直停留在最后一帧（如摄像头或正在写入的文件）
+
+    第 i 个分块的帧是灰度为 (i + 1) * 40 的纯色图，由 ShadeDecoder 还原为分块内容
+    """
+
+    def __init__(self, count, hold, total):
+        self.count = count
+        self.hold = hold
+        self.total = total
+        self.index = 0
+
+    def read(self, image=None):
+        if self.index >= self.total:
+            return False, None
+        chunk = min(self.index // self.hold, self.count - 1)
+        self.index += 1
+        return True, np.full((120, 160, 3), (chunk + 1) * 40, np.uint8)
+
+    def get(self, prop):
+        return 0
+
+
+class SequenceSource:
+    """按给定顺序显示分块的视频文件（每个分块 hold 帧），读完即结束"""
+
+    def __init__(self, order, hold):
+        self.order = order
+        self.hold = hold
+        self.index = 0
+
+    def read(self, image=None):
+        if self.index >= len(self.order) * self.hold:
+            return False, None
+        chunk = self.order[self.index // self.hold]
+        self.index += 1
+        return True, np.full((120, 160, 3), (chunk + 1) * 40, np.uint8)
+
+    def get(self, prop):
+        return len(self.order) * self.hold
+
+
+class ShadeDecoder:
+    """按帧的灰度返回对应分块，不依赖二维码识别的成功率"""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def decode(self, image):
+        chunk = int(image[0, 0]) // 40 - 1
+        height, width = image.shape[:2]
+        return [(self.chunks[chunk], [(0, 0), (width, 0), (width, height), (0, height)])]
+
+
+def make_scanner(tmp_path, **kwargs):
+    plan = QRProcessor(str(tmp_path)).plan_qr_chunks(os.urandom(600), max_size=300)
+    scanner = VideoScanner("opencv", workers=2, **kwargs)
+    scanner.decoder = ShadeDecoder([content for _, content, _ in plan])
+    return scanner, len(plan)
+
+
+def make_two_file_scanner(tmp_path, **kwargs):
+    """两个文件的分块: 文件 A 是 0-2 号，文件 B 是 3-4 号"""
+    processor = QRProcessor(str(tmp_path))
+    chunks = [content for data in (os.urandom(600), os.urandom(400))
+              for _, content, _ in processor.plan_qr_chunks(data, max_size=300)]
+    assert len(chunks) == 5
+    scanner = VideoScanner("opencv", workers=2, **kwargs)
+    scanner.decoder = ShadeDecoder(chunks)
+    return scanner
+
+
+FILE_A = [0, 1, 2]
+FILE_B = [3, 4]
+
+
+def test_stream_stops_after_transfer_completes(tmp_path):
+    scanner, count = make_scanner(tmp_path, settle_frames=STREAM_SETTLE_FRAMES)
+    scanner.run(LinearSource(count, hold=10, total=1030))
+
+    assert scanner.assembler.complete
+    assert scanner.stopped_early
+    # 齐全时采集线程最多领先解码线程一个队列的帧
+    assert scanner.frames_read <= count * 10 + VIDEO_QUEUE_SIZE + 2 + STREAM_SETTLE_FRAMES + 10
+
+
+def test_file_scan_waits_for_the_video_to_loop(tmp_path):
+    scanner, count = make_scanner(tmp_path)
+    scanner.run(LinearSource(count, hold=10, total=300))
+
+    assert scanner.assembler.complete
+    assert not scanner.stopped_early
+    assert scanner.frames_read == 300
+
+
+def test_expect_transfers_waits_for_a_later_file(tmp_path):
+    # 文件 A 播放两遍后才出现文件 B: 按循环推测会在 B 之前结束
+    scanner = make_two_file_scanner(tmp_path, expect_transfers=2)
+    scanner.run(SequenceSource(FILE_A + FILE_A + FILE_B + FILE_A * 10, hold=10))
+
+    assert len(scanner.assembler.transfers) == 2
+    assert scanner.assembler.complete
+    assert scanner.stopped_early
+    assert scanner.frames_read <= 80 + VIDEO_QUEUE_SIZE + 2 + 10
+
+
+def test_scan_reads_whole_video_when_early_stop_is_off(tmp_path):
+    scanner = make_two_file_scanner(tmp_path, stop_when_complete=False)
+    scanner.run(SequenceSource(FILE_A + FILE_A + FILE_B, hold=10))
+
+    assert len(scanner.assembler.transfers) == 2
+    assert scanner.assembler.complete
+    assert not scanner.stopped_early
+    assert scanner.frames_read == 80